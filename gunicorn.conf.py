@@ -0,0 +1,37 @@
+"""
+Gunicorn configuration, picked up automatically by `gunicorn` run from the
+project root.
+
+By default it serves pharmacy_project/wsgi.py with threaded workers;
+SERVER_INTERFACE=asgi serves pharmacy_project/asgi.py with uvicorn workers
+instead. Tune with WEB_CONCURRENCY (worker processes, default 2 x CPUs + 1),
+GUNICORN_THREADS (threads per WSGI worker, default 4) and GUNICORN_BIND.
+Each thread keeps its own persistent database connection. The workers share
+state through the cache, so CACHE_URL must point at a shared one (see
+settings_production.py).
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pharmacy_project.settings_production')
+
+if os.environ.get('SERVER_INTERFACE', 'wsgi') == 'asgi':
+    wsgi_app = 'pharmacy_project.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'pharmacy_project.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# The workers inherit it, so the settings can tell they are not alone
+os.environ['WEB_CONCURRENCY'] = str(workers)
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so slow leaks never build up
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
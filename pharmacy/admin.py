@@ -2,7 +2,10 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.contrib.admin import AdminSite
 from django.contrib.auth.models import User
-from .models import Category, Product, ProductImage, Prescription, Order, OrderItem, Doctor, Specialization, Banner, Coupon, PaymentMethod, Wishlist
+from .models import Category, Product, ProductImage, Prescription, Order, OrderItem, Doctor, Specialization, Banner, Coupon, PaymentMethod, Wishlist, FeaturedProduct, StockAlert, StockBatch, Task
+from . import metrics, review
+from .tasks import notify_users
+from .templatetags.pharmacy_images import thumbnail_url
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -45,13 +48,20 @@ class ProductImageInline(admin.TabularInline):
     max_num = 4
     fields = ['image', 'alt_text', 'is_primary']
 
+class StockBatchInline(admin.TabularInline):
+    model = StockBatch
+    extra = 1
+    fields = ['batch_number', 'expiry_date', 'quantity', 'received_at']
+    readonly_fields = ['received_at']
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'stock', 'is_prescription', 'image_preview']
     list_filter = ['category', 'is_prescription', 'created_at']
     search_fields = ['name', 'description']
-    list_editable = ['price', 'stock']
-    inlines = [ProductImageInline]
+    list_editable = ['price']
+    readonly_fields = ['stock', 'expiry_date', 'batch_number']
+    inlines = [StockBatchInline, ProductImageInline]
     
     fieldsets = (
         ('Basic Information', {
@@ -61,6 +71,9 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('benefits', 'ingredients', 'uses', 'side_effects', 'how_to_use', 'precautions', 'safety_info'),
             'classes': ('collapse',)
         }),
+        ('Next Batch to Sell', {
+            'fields': ('batch_number', 'expiry_date'),
+        }),
     )
     
     def image_preview(self, obj):
@@ -75,7 +88,9 @@ class PrescriptionAdmin(admin.ModelAdmin):
     list_filter = ['status', 'is_urgent', 'uploaded_at', 'doctor__specialization']
     list_editable = ['status']
     search_fields = ['patient_name', 'doctor_name', 'patient_email']
-    readonly_fields = ['uploaded_at', 'user']
+    readonly_fields = ['uploaded_at', 'user', 'claimed_by', 'claimed_at']
+    ordering = ['-is_urgent', 'uploaded_at']
+    actions = ['approve_prescriptions', 'reject_prescriptions']
     
     fieldsets = (
         ('Patient Information', {
@@ -95,9 +110,19 @@ class PrescriptionAdmin(admin.ModelAdmin):
     
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" width="50" height="50" style="object-fit: cover; border-radius: 5px;" />', obj.image.url)
+            return format_html('<img src="{}" width="50" height="50" loading="lazy" style="object-fit: cover; border-radius: 5px;" />', thumbnail_url(obj.image))
         return "No Image"
     image_preview.short_description = 'Prescription'
+
+    @admin.action(description='Approve selected pending prescriptions')
+    def approve_prescriptions(self, request, queryset):
+        decided = review.decide(request.user, queryset.values_list('pk', flat=True), 'approved', claimed_only=False)
+        self.message_user(request, f'{decided} prescriptions approved.')
+
+    @admin.action(description='Reject selected pending prescriptions')
+    def reject_prescriptions(self, request, queryset):
+        decided = review.decide(request.user, queryset.values_list('pk', flat=True), 'rejected', claimed_only=False)
+        self.message_user(request, f'{decided} prescriptions rejected.')
     
     def save_model(self, request, obj, form, change):
         if change and 'status' in form.changed_data:
@@ -105,6 +130,10 @@ class PrescriptionAdmin(admin.ModelAdmin):
             from django.utils import timezone
             obj.reviewed_at = timezone.now()
         super().save_model(request, obj, form, change)
+        if change and 'status' in form.changed_data:
+            notify_users([obj.user_id], f'Prescription {obj.get_status_display().lower()}',
+                         f'Your prescription from Dr. {obj.doctor_name} is now {obj.get_status_display().lower()}.',
+                         'prescription')
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -148,6 +177,44 @@ class BannerAdmin(admin.ModelAdmin):
         return "No Icon"
     icon_preview.short_description = 'Icon'
 
+@admin.register(FeaturedProduct)
+class FeaturedProductAdmin(admin.ModelAdmin):
+    list_display = ['rank', 'product', 'score', 'computed_at']
+    list_select_related = ['product']
+    readonly_fields = ['rank', 'product', 'score', 'computed_at']
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(StockAlert)
+class StockAlertAdmin(admin.ModelAdmin):
+    list_display = ['product', 'kind', 'batch_number', 'expiry_date', 'stock_level', 'raised_at', 'resolved_at']
+    list_filter = ['kind', ('resolved_at', admin.EmptyFieldListFilter)]
+    list_select_related = ['product']
+    search_fields = ['product__name', 'batch_number']
+    readonly_fields = [field.name for field in StockAlert._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'priority', 'attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = [field.name for field in Task._meta.fields]
+    actions = ['retry_tasks']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Retry selected tasks now')
+    def retry_tasks(self, request, queryset):
+        from django.utils import timezone
+        updated = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=timezone.now(), finished_at=None,
+        )
+        self.message_user(request, f'{updated} tasks queued again.')
+
 # Custom admin site configuration
 class PharmacyAdminSite(AdminSite):
     site_header = 'AyuRx Pharmacy Administration'
@@ -156,21 +223,28 @@ class PharmacyAdminSite(AdminSite):
     
     def index(self, request, extra_context=None):
         extra_context = extra_context or {}
+        # Precomputed counters (see metrics.py), not COUNT(*) on every load
+        stats = metrics.values()
         extra_context.update({
-            'products_count': Product.objects.count(),
-            'orders_count': Order.objects.count(),
-            'users_count': User.objects.count(),
-            'categories_count': Category.objects.count(),
+            'products_count': int(stats[metrics.PRODUCTS]),
+            'orders_count': int(stats[metrics.ORDERS]),
+            'users_count': int(stats[metrics.USERS]),
+            'categories_count': int(stats[metrics.CATEGORIES]),
+            'revenue_total': stats[metrics.REVENUE],
+            'pending_prescriptions_count': int(stats[metrics.PENDING_PRESCRIPTIONS]),
+            'low_stock_count': int(stats[metrics.LOW_STOCK]),
         })
         return super().index(request, extra_context)
 
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
-    list_display = ['code', 'discount_type', 'discount_value', 'minimum_amount', 'used_count', 'maximum_uses', 'is_active', 'valid_from', 'valid_to']
+    list_display = ['code', 'discount_type', 'discount_value', 'minimum_amount', 'used_count', 'maximum_uses', 'max_uses_per_user', 'is_active', 'valid_from', 'valid_to']
     list_filter = ['discount_type', 'is_active', 'valid_from', 'valid_to']
     search_fields = ['code']
     list_editable = ['is_active']
     readonly_fields = ['used_count']
+    filter_horizontal = ['categories']
+    autocomplete_fields = ['products']
 
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(admin.ModelAdmin):
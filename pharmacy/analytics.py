@@ -0,0 +1,107 @@
+"""
+Buffered product analytics.
+
+Product page views are counted in process memory and written back in batches
+by a background thread, so serving product_detail never waits on a write.
+Each flush issues one `UPDATE ... SET view_count = view_count + n` per
+distinct n, which for real traffic is a handful of statements. Whatever is
+still buffered when the process exits is flushed by an atexit hook, which
+first waits for a flush the thread may have in progress.
+
+purchase_count is not buffered: it is bumped in the same UPDATE that reserves
+stock when an order is placed (see orders.reserve_stock).
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'PHARMACY_ANALYTICS_FLUSH_INTERVAL', 30)  # seconds
+
+
+class CounterBuffer:
+    """Thread-safe in-memory deltas for one Product counter column"""
+
+    def __init__(self, field, interval=FLUSH_INTERVAL):
+        self.field = field
+        self.interval = interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        # Held for a whole flush, so a flush at exit cannot miss deltas the
+        # thread has taken out of _pending but not written yet
+        self._flushing = threading.Lock()
+        self._thread = None
+
+    def record(self, product_id, amount=1):
+        with self._lock:
+            self._pending[product_id] += amount
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # Started lazily so every forked server worker gets its own thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f'analytics-{self.field}', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush %s deltas', self.field)
+            finally:
+                connection.close()
+
+    def flush(self):
+        """Write all pending deltas, return the number of products touched"""
+        with self._flushing:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+
+        from .models import Product
+        by_amount = defaultdict(list)
+        for product_id, amount in pending.items():
+            by_amount[amount].append(product_id)
+        try:
+            with transaction.atomic():
+                for amount, product_ids in by_amount.items():
+                    Product.objects.filter(pk__in=product_ids).update(**{self.field: F(self.field) + amount})
+        except Exception:
+            # Put the deltas back so they are retried on the next flush
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        return len(pending)
+
+
+view_counter = CounterBuffer('view_count')
+
+
+def record_view(product_id):
+    view_counter.record(product_id)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        logger.exception('Failed to flush view counts on exit')
@@ -0,0 +1,266 @@
+"""
+Read-only JSON API, version 1, for the mobile app.
+
+    GET /api/v1/products/            ?q= &category= &min_price= &max_price= &sort=
+    GET /api/v1/products/<id>/
+    GET /api/v1/categories/
+    GET /api/v1/doctors/             ?specialization=
+    GET /api/v1/banners/
+
+- `?fields=a,b` picks the fields of every object; unknown names are a 400,
+  and so are filters that cannot be parsed (see filters.py).
+  Product queries only load the columns the requested fields need.
+- Lists are keyset paginated like the storefront (`?cursor=`, `?page_size=`);
+  `next` is the URL of the following page, or null.
+- Every response carries a strong ETag and a matching If-None-Match gets a
+  304. Product ETags hash the (id, updated_at) of the rows being returned,
+  read with one narrow query before anything is loaded or serialized.
+  Categories, doctors and banners use the cache generation their model
+  signals already bump, so revalidating them needs no query at all.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+
+from . import caching, reference
+from .filters import InvalidFilter, filter_doctors, search_catalog
+from .models import Banner, Product
+from .pagination import PRODUCT_SORTS, keyset, paginate, parse_page_size
+
+VERSION = 1
+
+
+class ApiError(Exception):
+    """A request the API answers with a 400 and this message"""
+
+
+def _filtered(apply, request):
+    """apply(request.GET) from filters.py, with unparsable parameters as an ApiError"""
+    try:
+        return apply(request.GET)
+    except InvalidFilter as exc:
+        raise ApiError(str(exc)) from exc
+
+
+def _image_url(fieldfile):
+    return fieldfile.url if fieldfile else None
+
+
+def _attr(name):
+    return lambda obj: getattr(obj, name)
+
+
+PRODUCT_FIELDS = {
+    'id': _attr('pk'),
+    'name': _attr('name'),
+    'slug': _attr('slug'),
+    'brand': _attr('brand'),
+    'manufacturer': _attr('manufacturer'),
+    'category': lambda product: {'id': product.category_id, 'name': product.category.name},
+    'short_description': _attr('short_description'),
+    'description': _attr('description'),
+    'price': lambda product: str(product.price),
+    'mrp': lambda product: str(product.mrp),
+    'discount_percentage': _attr('discount_percentage'),
+    'stock': _attr('stock'),
+    'in_stock': lambda product: product.stock > 0,
+    'is_prescription': _attr('is_prescription'),
+    'is_featured': _attr('is_featured'),
+    'rating': lambda product: {'average': str(product.rating_avg), 'count': product.rating_count},
+    'expiry_date': lambda product: product.expiry_date and product.expiry_date.isoformat(),
+    'image': lambda product: _image_url(product.image),
+    'url': lambda product: reverse('pharmacy:product_detail', args=[product.pk]),
+    'updated_at': lambda product: product.updated_at.isoformat(),
+    **{name: _attr(name) for name in (
+        'benefits', 'ingredients', 'uses', 'side_effects', 'how_to_use', 'precautions', 'safety_info',
+        'storage_instructions',
+    )},
+}
+# Columns a product field reads, where they are not just the column of the same name
+PRODUCT_COLUMNS = {
+    'id': (),
+    'category': ('category__name',),
+    'discount_percentage': ('price', 'mrp'),
+    'in_stock': ('stock',),
+    'rating': ('rating_avg', 'rating_count'),
+    'url': (),
+}
+PRODUCT_LIST_FIELDS = (
+    'id', 'name', 'slug', 'brand', 'category', 'price', 'mrp', 'discount_percentage', 'in_stock',
+    'is_prescription', 'rating', 'image', 'url', 'updated_at',
+)
+
+CATEGORY_FIELDS = {
+    'id': lambda category: category.pk,
+    'name': lambda category: category.name,
+    'description': lambda category: category.description,
+    'product_count': lambda category: category.product_count,
+}
+
+DOCTOR_FIELDS = {
+    'id': lambda doctor: doctor.pk,
+    'name': lambda doctor: doctor.name,
+    'specialization': lambda doctor: {'id': doctor.specialization_id, 'name': doctor.specialization.name},
+    'hospital': lambda doctor: doctor.hospital,
+    'experience_years': lambda doctor: doctor.experience_years,
+    'photo': lambda doctor: _image_url(doctor.photo),
+}
+
+BANNER_FIELDS = {
+    'id': lambda banner: banner.pk,
+    'title': lambda banner: banner.title,
+    'icon': lambda banner: banner.icon,
+    'photo': lambda banner: _image_url(banner.photo),
+    'link_url': lambda banner: banner.link_url,
+    'order': lambda banner: banner.order,
+}
+
+
+def _requested_fields(request, available, default=None):
+    param = request.GET.get('fields', '')
+    names = [name.strip() for name in param.split(',') if name.strip()]
+    if not names:
+        return list(default or available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f'Unknown fields: {", ".join(unknown)}. Available: {", ".join(available)}.')
+    return names
+
+
+def _serialize(obj, available, names):
+    return {name: available[name](obj) for name in names}
+
+
+def _etag(request, resource, state):
+    """Strong ETag for a representation, from everything it depends on"""
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    digest = hashlib.sha256(json.dumps([VERSION, resource, params, state], default=str).encode()).hexdigest()
+    return quote_etag(digest[:32])
+
+
+def _respond(request, etag, build):
+    """304 if the client already has etag, otherwise the JSON body from build()"""
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(build())
+    response.headers['ETag'] = etag
+    # Clients may keep the body but must revalidate before reusing it
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _next_url(request, page):
+    if not page.next_cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = page.next_cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+def api_view(view):
+    """GET only; errors are answered in JSON, invalid parameters with a 400"""
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except Http404:
+            return JsonResponse({'error': 'Not found.'}, status=404)
+        except ApiError as exc:
+            return JsonResponse({'error': str(exc) or 'Invalid request.'}, status=400)
+    return wrapper
+
+
+def _product_columns(names, *extra):
+    columns = {'id', 'category', *extra}
+    for name in names:
+        columns.update(PRODUCT_COLUMNS.get(name, (name,)))
+    return columns
+
+
+@api_view
+def products(request):
+    names = _requested_fields(request, PRODUCT_FIELDS, PRODUCT_LIST_FIELDS)
+    queryset, sort_by = _filtered(search_catalog, request)
+    field, descending = PRODUCT_SORTS[sort_by]
+    cursor = request.GET.get('cursor')
+    page_size = parse_page_size(request.GET.get('page_size'))
+
+    # The rows this page will show and when each last changed: two narrow
+    # columns along the listing index, all a revalidation costs. Category
+    # names are covered by the reference generation.
+    state = list(keyset(queryset, field, descending, cursor).values_list('pk', 'updated_at')[:page_size + 1])
+    etag = _etag(request, 'products', [state, caching.generation(reference.REFERENCE)])
+
+    def build():
+        columns = _product_columns(names, field) - {'search_rank'}
+        page = paginate(queryset.only(*columns), field, descending, cursor=cursor, page_size=page_size)
+        return {
+            'results': [_serialize(product, PRODUCT_FIELDS, names) for product in page],
+            'next': _next_url(request, page),
+        }
+    return _respond(request, etag, build)
+
+
+@api_view
+def product_detail(request, pk):
+    names = _requested_fields(request, PRODUCT_FIELDS)
+    active = Product.objects.filter(is_active=True)
+    updated_at = active.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        raise Http404
+    etag = _etag(request, f'products/{pk}', [updated_at, caching.generation(reference.REFERENCE)])
+
+    def build():
+        product = get_object_or_404(active.select_related('category').only(*_product_columns(names)), pk=pk)
+        return _serialize(product, PRODUCT_FIELDS, names)
+    return _respond(request, etag, build)
+
+
+@api_view
+def categories(request):
+    names = _requested_fields(request, CATEGORY_FIELDS)
+    etag = _etag(request, 'categories', caching.generation(reference.REFERENCE))
+    return _respond(request, etag, lambda: {
+        'results': [_serialize(category, CATEGORY_FIELDS, names) for category in reference.categories()],
+        'next': None,
+    })
+
+
+@api_view
+def doctors(request):
+    names = _requested_fields(request, DOCTOR_FIELDS)
+    queryset = _filtered(filter_doctors, request)
+    etag = _etag(request, 'doctors', caching.generation(caching.DOCTORS))
+
+    def build():
+        page = paginate(
+            queryset, 'name',
+            cursor=request.GET.get('cursor'),
+            page_size=parse_page_size(request.GET.get('page_size')),
+        )
+        return {
+            'results': [_serialize(doctor, DOCTOR_FIELDS, names) for doctor in page],
+            'next': _next_url(request, page),
+        }
+    return _respond(request, etag, build)
+
+
+@api_view
+def banners(request):
+    names = _requested_fields(request, BANNER_FIELDS)
+    etag = _etag(request, 'banners', caching.generation(caching.HOME))
+    return _respond(request, etag, lambda: {
+        'results': [
+            _serialize(banner, BANNER_FIELDS, names)
+            for banner in Banner.objects.filter(is_active=True).order_by('order', 'created_at')
+        ],
+        'next': None,
+    })
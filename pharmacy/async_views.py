@@ -0,0 +1,143 @@
+"""
+Native async versions of the read-heavy storefront pages.
+
+Under ASGI a sync view costs a thread hop per request; these run on the event
+loop and use the async ORM instead. urls.py routes to them when
+PHARMACY_ASYNC_VIEWS is on (settings_production turns it on with
+SERVER_INTERFACE=asgi), and they render the same templates with the same
+context as their counterparts in views.py.
+
+Templates and context processors read the user, the session and the cart
+summary synchronously, which must not touch the database from the event
+loop, so each view resolves them up front, next to its other independent
+lookups in one asyncio.gather(). Everything a template
+reads is fetched here: related rows with select_related/prefetch_related and
+lists instead of lazy querysets.
+
+Django runs the async ORM's queries for one request on one database thread,
+so gathering them saves the hops between them rather than overlapping the
+queries; requests themselves run concurrently. Search still goes through
+sync_to_async: the full-text backends use raw SQL, which has no async API.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, redirect, render
+
+from . import caching, featured, reference
+from .analytics import record_view
+from .cartstore import get_cart
+from .filters import filter_category, filter_doctors
+from .models import Banner, Product, ProductComment, Wishlist
+from .pagination import PRODUCT_SORTS, apaginate
+from .search import search_products
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _resolve_user(request):
+    """Replace the lazy request.user, loading the session and the cart summary on the way"""
+    request.user = await request.auser()
+    await get_cart(request).aload_summary()
+    return request.user
+
+
+async def _banners():
+    return await _alist(Banner.objects.filter(is_active=True).order_by('order', 'created_at'))
+
+
+async def home(request):
+    featured_products, categories, banners, home_generation, _ = await asyncio.gather(
+        caching.acached(caching.HOME, 'featured_products', lambda: featured.afeatured_products(4)),
+        reference.acategories(),
+        caching.acached(caching.HOME, 'banners', _banners),
+        caching.ageneration(caching.HOME),
+        _resolve_user(request),
+    )
+    return render(request, 'pharmacy/home.html', {
+        'featured_products': featured_products,
+        'categories': categories,
+        'banners': banners,
+        'home_generation': home_generation,
+        'fragment_timeout': caching.CACHE_TIMEOUT,
+    })
+
+
+async def product_list(request):
+    products = Product.objects.filter(is_active=True)
+    search_query = request.GET.get('search')
+    if search_query:
+        products = await sync_to_async(search_products)(search_query, products)
+    products = filter_category(products, request.GET.get('category'))
+
+    field, descending = PRODUCT_SORTS['relevance' if search_query else 'name']
+    page, categories, total_product_count, _ = await asyncio.gather(
+        apaginate(products.select_related('category'), field, descending, cursor=request.GET.get('cursor')),
+        reference.acategories(),
+        reference.atotal_product_count(),
+        _resolve_user(request),
+    )
+    return render(request, 'pharmacy/product_list.html', {
+        'products': page.items,
+        'page': page,
+        'categories': categories,
+        'total_product_count': total_product_count,
+    })
+
+
+async def product_detail(request, pk):
+    product, user = await asyncio.gather(
+        aget_object_or_404(Product.objects.select_related('category').prefetch_related('images'), pk=pk),
+        _resolve_user(request),
+    )
+
+    if request.method == 'POST' and user.is_authenticated:
+        comment_text = request.POST.get('comment')
+        if comment_text:
+            await ProductComment.objects.acreate(
+                product=product,
+                user=user,
+                comment=comment_text,
+                rating=int(request.POST.get('rating', 5)),
+            )
+            messages.success(request, 'Your review has been added!')
+            return redirect('pharmacy:product_detail', pk=pk)
+
+    record_view(product.pk)
+
+    comments, suggested_products = await asyncio.gather(
+        _alist(ProductComment.objects.filter(product=product).select_related('user').order_by('-created_at')),
+        _alist(Product.objects.filter(category_id=product.category_id).exclude(id=product.id)[:4]),
+    )
+    return render(request, 'pharmacy/product_detail.html', {
+        'product': product,
+        'comments': comments,
+        'suggested_products': suggested_products,
+    })
+
+
+async def doctors(request):
+    page, specializations, _ = await asyncio.gather(
+        apaginate(filter_doctors(request.GET), 'name', cursor=request.GET.get('cursor')),
+        reference.aspecializations(),
+        _resolve_user(request),
+    )
+    return render(request, 'pharmacy/doctors.html', {
+        'doctors': page.items,
+        'page': page,
+        'specializations': specializations,
+    })
+
+
+@login_required
+async def wishlist_view(request):
+    # The only query needs the user, so there is nothing to overlap
+    user = await _resolve_user(request)
+    wishlist_items = await _alist(Wishlist.objects.filter(user=user).select_related('product'))
+    return render(request, 'pharmacy/wishlist.html', {
+        'wishlist_items': wishlist_items,
+    })
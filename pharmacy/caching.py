@@ -0,0 +1,93 @@
+"""
+Generation-based caching for rendered pages and the querysets behind them.
+
+Every namespace ("home", ...) has a generation number stored in the cache.
+Keys and template fragments include the generation, so invalidating a
+namespace is a single `incr` and stale entries simply age out. Model signals
+(see signals.py) bump the generations when the underlying rows change.
+
+ageneration() and acached() are the same lookups for async views, through
+the cache's async API.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+CACHE_TIMEOUT = getattr(settings, 'PHARMACY_CACHE_TIMEOUT', 600)  # seconds
+
+HOME = 'home'
+DOCTORS = 'doctors'
+
+
+def _generation_key(namespace):
+    return f'pharmacy:generation:{namespace}'
+
+
+def _fresh_generation():
+    # Seeded from the clock so a flushed or restarted cache can never hand
+    # out a generation that was already used before.
+    return time.time_ns() // 1000
+
+
+def generation(namespace):
+    """Current generation of a namespace"""
+    key = _generation_key(namespace)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _fresh_generation(), timeout=None)
+        value = cache.get(key)
+    if value is None:
+        # A cache that stores nothing (DummyCache): never reuse anything
+        value = _fresh_generation()
+    return value
+
+
+async def ageneration(namespace):
+    """generation() for async code"""
+    key = _generation_key(namespace)
+    value = await cache.aget(key)
+    if value is None:
+        await cache.aadd(key, _fresh_generation(), timeout=None)
+        value = await cache.aget(key)
+    if value is None:
+        value = _fresh_generation()
+    return value
+
+
+def invalidate(*namespaces):
+    """Move namespaces to a new generation, orphaning every cached entry"""
+    for namespace in namespaces:
+        key = _generation_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not cached yet (or evicted): any fresh generation will do
+            cache.set(key, _fresh_generation(), timeout=None)
+
+
+def cached(namespace, name, producer, timeout=CACHE_TIMEOUT):
+    """Return producer() through the cache, keyed by the namespace generation"""
+    key = f'pharmacy:{namespace}:{generation(namespace)}:{name}'
+    return cache.get_or_set(key, producer, timeout)
+
+
+async def acached(namespace, name, producer, timeout=CACHE_TIMEOUT):
+    """cached() for async code; producer is a coroutine function"""
+    key = f'pharmacy:{namespace}:{await ageneration(namespace)}:{name}'
+    value = await cache.aget(key)
+    if value is None:
+        value = await producer()
+        await cache.aadd(key, value, timeout)
+    return value
+
+
+def lazy_cached(namespace, name, producer, timeout=CACHE_TIMEOUT):
+    """
+    Like cached(), but deferred until the value is first used.
+
+    Handy for template context feeding a cached fragment: when the fragment
+    itself is served from the cache the value is never looked up at all.
+    """
+    return SimpleLazyObject(lambda: cached(namespace, name, producer, timeout))
@@ -0,0 +1,99 @@
+"""
+Cart resolution and pricing.
+
+A cart is a {product_id: quantity} dict (cartstore.py keeps it). Everything
+that needs the products behind it, or money amounts derived from it, goes
+through this module so a cart of any size costs a single product query and is
+priced with Decimal.
+"""
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+
+from . import coupons
+from .models import Product
+
+TAX_RATE = Decimal('0.18')  # 18% GST
+FREE_SHIPPING_THRESHOLD = Decimal('500')
+SHIPPING_COST = Decimal('50')
+
+CENT = Decimal('0.01')
+
+
+def money(amount):
+    return Decimal(amount).quantize(CENT, ROUND_HALF_UP)
+
+
+@dataclass
+class CartItem:
+    product: Product
+    quantity: int
+
+    @property
+    def item_total(self):
+        return money(self.product.price * self.quantity)
+
+
+@dataclass
+class Cart:
+    items: list = field(default_factory=list)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def subtotal(self):
+        return money(sum((item.item_total for item in self.items), Decimal(0)))
+
+    @property
+    def count(self):
+        return sum(item.quantity for item in self.items)
+
+
+@dataclass
+class CheckoutTotals:
+    subtotal: Decimal
+    tax_amount: Decimal
+    shipping_cost: Decimal
+    discount_amount: Decimal
+    coupon: object = None
+
+    @property
+    def total_amount(self):
+        return money(self.subtotal + self.tax_amount + self.shipping_cost - self.discount_amount)
+
+
+def resolve_cart(lines):
+    """Turn a {product_id: quantity} dict into a Cart with one query"""
+    quantities = {}
+    for product_id, quantity in lines.items():
+        try:
+            quantities[int(product_id)] = int(quantity)
+        except (TypeError, ValueError):
+            continue
+    if not quantities:
+        return Cart()
+    products = Product.objects.select_related('category').in_bulk(list(quantities))
+    return Cart(items=[
+        CartItem(product=products[product_id], quantity=quantity)
+        for product_id, quantity in quantities.items()
+        if product_id in products and quantity > 0
+    ])
+
+
+def price_cart(cart, coupon=None):
+    """Compute tax, shipping and coupon discount (see coupons.evaluate) for a resolved cart"""
+    subtotal = cart.subtotal
+    discount_amount = coupons.evaluate(coupon, cart).discount if coupon is not None else Decimal(0)
+    return CheckoutTotals(
+        subtotal=subtotal,
+        tax_amount=money(subtotal * TAX_RATE),
+        shipping_cost=SHIPPING_COST if subtotal < FREE_SHIPPING_THRESHOLD else Decimal(0),
+        discount_amount=discount_amount,
+        coupon=coupon if discount_amount else None,
+    )
@@ -0,0 +1,240 @@
+"""
+Where carts are kept.
+
+A signed-in customer's cart is a set of CartLine rows, one per product, so
+changing it writes one small row instead of the whole session. An anonymous
+cart lives in a signed cookie ("12:2,40:1" is two of product 12 and one of
+product 40) and costs the server nothing to store. When a visitor logs in,
+merge_anonymous_cart() adds the cookie cart to their lines and the cookie is
+dropped.
+
+The header badge needs the number of units and lines on every page. For
+signed-in customers that summary is kept in the shared cache and rewritten by
+every change, so pages that do not touch the cart render it without a query;
+for visitors it comes from the cookie. The summary is keyed by a per-user
+generation (see caching.py) that signals.py bumps whenever cart lines go away
+behind the store's back, e.g. when deleting a product cascades to them, and
+it expires after a few minutes in any case.
+
+get_cart(request) returns the request's CartStore. CartMiddleware writes the
+cookie back when an anonymous cart changed. The {product_id: quantity}
+`lines` are what cart.resolve_cart() and orders.place_order() take.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import caching
+from .models import CartLine, Product
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'pharmacy.cart'
+COOKIE_MAX_AGE = 30 * 24 * 60 * 60  # seconds
+
+# Keeps the cookie well under the 4 KB browsers accept
+MAX_LINES = 100
+
+SUMMARY_TIMEOUT = 5 * 60  # seconds
+
+
+class CartFull(Exception):
+    pass
+
+
+def cart_namespace(user_id):
+    """Generation namespace of a customer's cart summary"""
+    return f'cart:{user_id}'
+
+
+def _summary_key(user_id, generation):
+    return f'pharmacy:cart:{user_id}:{generation}'
+
+
+def _summarize(lines):
+    """(units, lines) of a cart"""
+    return sum(lines.values()), len(lines)
+
+
+def _clean_lines(pairs):
+    """{product_id: quantity} from (product_id, quantity) pairs, skipping anything malformed"""
+    lines = {}
+    for product_id, quantity in pairs:
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except (TypeError, ValueError):
+            continue
+        if quantity > 0 and len(lines) < MAX_LINES:
+            lines[product_id] = quantity
+    return lines
+
+
+def parse_cookie(value):
+    return _clean_lines(item.split(':', 1) for item in (value or '').split(',') if ':' in item)
+
+
+def format_cookie(lines):
+    return ','.join(f'{product_id}:{quantity}' for product_id, quantity in lines.items())
+
+
+def _cookie_lines(request):
+    return parse_cookie(request.get_signed_cookie(COOKIE_NAME, '', salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE))
+
+
+class CartStore:
+    """The cart of one request's visitor, loaded on first use"""
+
+    def __init__(self, request):
+        self.request = request
+        user = getattr(request, 'user', None)
+        self.user = user if user is not None and user.is_authenticated else None
+        self._lines = None
+        self._summary = None
+        self.changed = False
+
+    @property
+    def lines(self):
+        """{product_id: quantity}, in the order products were added"""
+        if self._lines is None:
+            if self.user is None:
+                self._lines = _cookie_lines(self.request)
+            else:
+                self._lines = dict(CartLine.objects.filter(user=self.user).values_list('product_id', 'quantity'))
+        return self._lines
+
+    def _cached_summary(self):
+        if self._summary is None and self._lines is None and self.user is not None:
+            self._summary = cache.get(self._cache_key())
+        if self._summary is None:
+            self._store_summary()
+        return self._summary
+
+    def _store_summary(self):
+        self._summary = _summarize(self.lines)
+        if self.user is not None:
+            cache.set(self._cache_key(), self._summary, SUMMARY_TIMEOUT)
+
+    def _cache_key(self):
+        return _summary_key(self.user.pk, caching.generation(cart_namespace(self.user.pk)))
+
+    async def aload_summary(self):
+        """Fill the summary for async views, whose templates read it synchronously"""
+        if self._summary is None and self._lines is None and self.user is not None:
+            key = _summary_key(self.user.pk, await caching.ageneration(cart_namespace(self.user.pk)))
+            self._summary = await cache.aget(key)
+            if self._summary is None:
+                self._lines = {
+                    product_id: quantity
+                    async for product_id, quantity in CartLine.objects.filter(user=self.user).values_list(
+                        'product_id', 'quantity',
+                    )
+                }
+                self._summary = _summarize(self._lines)
+                await cache.aset(key, self._summary, SUMMARY_TIMEOUT)
+        return self._cached_summary()
+
+    @property
+    def count(self):
+        """Units in the cart"""
+        return self._cached_summary()[0]
+
+    @property
+    def line_count(self):
+        return self._cached_summary()[1]
+
+    def add(self, product_id, quantity=1):
+        self.set(product_id, self.lines.get(product_id, 0) + quantity)
+
+    def set(self, product_id, quantity):
+        """Put quantity of the product in the cart; 0 removes it"""
+        if quantity > 0 and product_id not in self.lines and len(self.lines) >= MAX_LINES:
+            raise CartFull(f'A cart holds at most {MAX_LINES} different products.')
+        self._set(product_id, quantity)
+
+    def decrease(self, product_id, quantity=1):
+        if product_id in self.lines:
+            self._set(product_id, self.lines[product_id] - quantity)
+
+    def remove(self, product_id):
+        self._set(product_id, 0)
+
+    def clear(self):
+        if self.user is not None:
+            CartLine.objects.filter(user=self.user).delete()
+        self._lines = {}
+        self._changed()
+
+    def restore(self, lines):
+        """Make an anonymous cart lines again, e.g. to resend a cookie a lost response carried"""
+        self._lines = dict(lines)
+        self._changed()
+
+    def _set(self, product_id, quantity):
+        if quantity > 0:
+            self.lines[product_id] = quantity
+        elif self.lines.pop(product_id, None) is None:
+            return
+        if self.user is not None:
+            if quantity > 0:
+                CartLine.objects.bulk_create(
+                    [CartLine(user=self.user, product_id=product_id, quantity=quantity)],
+                    update_conflicts=True, unique_fields=['user', 'product'], update_fields=['quantity'],
+                )
+            else:
+                CartLine.objects.filter(user=self.user, product_id=product_id).delete()
+        self._changed()
+
+    def _changed(self):
+        self.changed = True
+        self._store_summary()
+
+    def write_cookie(self, response):
+        """Save a changed anonymous cart; drop the cookie once the visitor has signed in"""
+        if self.user is None and self.changed:
+            if self._lines:
+                response.set_signed_cookie(
+                    COOKIE_NAME, format_cookie(self._lines), salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE,
+                    secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+                )
+            else:
+                response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        elif self.user is not None and COOKIE_NAME in self.request.COOKIES:
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+
+
+def get_cart(request):
+    """The CartStore of the request's visitor, one per request"""
+    store = getattr(request, '_cart_store', None)
+    if store is None:
+        store = request._cart_store = CartStore(request)
+    return store
+
+
+def merge_anonymous_cart(request, user):
+    """
+    Add the cart the visitor built before logging in to user's cart.
+
+    Call right after login(). Quantities of products already in the user's
+    cart are added up. Carts from the session, where they used to be kept,
+    are merged the same way.
+    """
+    incoming = _cookie_lines(request)
+    legacy = request.session.pop('cart', None)
+    for product_id, quantity in _clean_lines(legacy.items() if isinstance(legacy, dict) else ()).items():
+        incoming[product_id] = incoming.get(product_id, 0) + quantity
+    if incoming:
+        with transaction.atomic():
+            current = dict(
+                CartLine.objects.select_for_update().filter(user=user, product_id__in=incoming)
+                .values_list('product_id', 'quantity')
+            )
+            CartLine.objects.bulk_create(
+                [
+                    CartLine(user=user, product_id=product_id, quantity=current.get(product_id, 0) + incoming[product_id])
+                    for product_id in Product.objects.filter(pk__in=incoming).values_list('pk', flat=True)
+                ],
+                update_conflicts=True, unique_fields=['user', 'product'], update_fields=['quantity'],
+            )
+        caching.invalidate(cart_namespace(user.pk))
+    # The request's store still belongs to the anonymous visitor
+    request._cart_store = CartStore(request)
+    return get_cart(request)
@@ -0,0 +1,250 @@
+"""
+Bulk catalog import and export for distributor feeds.
+
+Feeds are CSV (with a header row) or JSON Lines, one product batch per row:
+the product columns in PRODUCT_FIELDS plus `category` (by name) and the
+optional stock columns `batch_number`, `expiry_date` and `stock`. A product
+held in several batches appears once per batch; export_rows() writes the
+catalog in the same shape, so an export can be imported back unchanged.
+
+Rows are streamed, never loaded whole. import_rows() validates them with the
+model fields, resolves categories through one preloaded name map and upserts
+each batch of products with a single bulk_create(update_conflicts=True)
+keyed on the slug, then upserts the stock batches the same way. bulk_create
+bypasses model signals, so every batch refreshes the stock aggregate and the
+search index itself, and the dashboard counters and caches are brought up to
+date once at the end.
+"""
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import BooleanField, Prefetch
+from django.utils.text import slugify
+
+from . import caching, inventory, metrics, reference
+from .models import Category, Product, StockBatch
+from .search import get_backend
+
+FORMATS = ('csv', 'jsonl')
+
+PRODUCT_FIELDS = (
+    'name', 'slug', 'brand', 'manufacturer', 'description', 'short_description', 'price', 'mrp',
+    'min_stock_level', 'is_prescription', 'is_featured', 'is_active', 'weight', 'dimensions',
+    'meta_title', 'meta_description', 'benefits', 'ingredients', 'uses', 'side_effects', 'how_to_use',
+    'precautions', 'safety_info', 'storage_instructions',
+)
+BATCH_FIELDS = ('batch_number', 'expiry_date', 'stock')
+COLUMNS = PRODUCT_FIELDS[:2] + ('category',) + PRODUCT_FIELDS[2:] + BATCH_FIELDS
+
+# Spellings feeds use for booleans, beyond what BooleanField accepts
+BOOLEANS = {'true': True, 'yes': True, 'y': True, '1': True, 'false': False, 'no': False, 'n': False, '0': False}
+
+# Invalid rows beyond this many are counted but not kept
+MAX_REPORTED_ERRORS = 100
+
+
+@dataclass
+class ImportProgress:
+    rows: int = 0
+    products: int = 0
+    batches: int = 0
+    invalid: int = 0
+    errors: list = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rate(self):
+        return self.rows / max(time.monotonic() - self.started, 1e-6)
+
+
+def detect_format(path):
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, {column: raw value}) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError:
+            yield line, None
+
+
+def _clean(model, name, raw):
+    model_field = model._meta.get_field(name)
+    if isinstance(raw, str):
+        raw = raw.strip()
+        if isinstance(model_field, BooleanField):
+            raw = BOOLEANS.get(raw.lower(), raw)
+    if raw in ('', None):
+        if model_field.has_default():
+            return model_field.get_default()
+        if model_field.null:
+            return None
+        if model_field.blank:
+            return ''
+    try:
+        return model_field.clean(raw, None)
+    except ValidationError as exc:
+        raise ValidationError(f'{name}: {" ".join(exc.messages)}') from None
+    except (TypeError, ValueError):
+        # JSON Lines values keep their JSON type, e.g. a date written as a number
+        raise ValidationError(f'{name}: Enter a valid value.') from None
+
+
+class RowCleaner:
+    """Turns raw feed rows into unsaved Product/StockBatch instances"""
+
+    def __init__(self, create_categories=False):
+        self.create_categories = create_categories
+        self.categories = {name.casefold(): pk for pk, name in Category.objects.values_list('pk', 'name')}
+
+    def category_id(self, name):
+        name = (name or '').strip()
+        if not name:
+            raise ValidationError('category: This field is required.')
+        pk = self.categories.get(name.casefold())
+        if pk is None:
+            if not self.create_categories:
+                raise ValidationError(f'category: unknown category "{name}"')
+            pk = self.categories[name.casefold()] = Category.objects.create(name=name).pk
+        return pk
+
+    def clean(self, row):
+        """Return (product, batch or None), raising ValidationError"""
+        if not isinstance(row, dict):
+            raise ValidationError('not a JSON object')
+        if row.get('mrp') in ('', None):
+            row = {**row, 'mrp': row.get('price')}
+        values = {name: _clean(Product, name, row.get(name)) for name in PRODUCT_FIELDS if name != 'slug'}
+        values['slug'] = slugify(row.get('slug') or values['name'])
+        if not values['slug']:
+            raise ValidationError('slug: could not derive a slug from the name')
+        product = Product(category_id=self.category_id(row.get('category')), **values)
+
+        if row.get('stock') in ('', None):
+            return product, None
+        batch_number = str(row.get('batch_number') or '').strip() or inventory.OPENING_BATCH
+        batch = StockBatch(
+            product=product,
+            batch_number=_clean(StockBatch, 'batch_number', batch_number),
+            expiry_date=_clean(StockBatch, 'expiry_date', row.get('expiry_date')),
+            quantity=_clean(StockBatch, 'quantity', row.get('stock')),
+        )
+        return product, batch
+
+
+def _upsert(products, batches):
+    """Write one batch of cleaned rows, return (saved products, stock batches written)"""
+    products = list({product.slug: product for product in products}.values())
+    Product.objects.bulk_create(
+        products, update_conflicts=True, unique_fields=['slug'],
+        update_fields=[name for name in PRODUCT_FIELDS if name != 'slug'] + ['category', 'updated_at'],
+    )
+    # Not every database returns the ids of upserted rows
+    ids = dict(Product.objects.filter(slug__in=[product.slug for product in products]).values_list('slug', 'pk'))
+    for product in products:
+        product.pk = ids[product.slug]
+
+    unique_batches = {}
+    for batch in batches:
+        # The row's product may be a duplicate slug that was dropped above
+        batch.product.pk = batch.product_id = ids[batch.product.slug]
+        unique_batches[(batch.product_id, batch.batch_number)] = batch
+    StockBatch.objects.bulk_create(
+        unique_batches.values(), update_conflicts=True, unique_fields=['product', 'batch_number'],
+        update_fields=['expiry_date', 'quantity'],
+    )
+    inventory.refresh_products(ids.values())
+    get_backend().index_products(products)
+    return products, len(unique_batches)
+
+
+def import_rows(rows, batch_size=1000, create_categories=False, progress=None):
+    """
+    Validate and upsert feed rows, one transaction per batch.
+
+    rows yields (line number, raw row). Invalid rows are skipped, counted in
+    progress.invalid and described in progress.errors. Yields the
+    ImportProgress after every batch.
+    """
+    progress = progress or ImportProgress()
+    cleaner = RowCleaner(create_categories)
+    products, batches = [], []
+
+    def flush():
+        with transaction.atomic():
+            saved, batch_count = _upsert(products, batches)
+        progress.products += len(saved)
+        progress.batches += batch_count
+        products.clear()
+        batches.clear()
+
+    for line, row in rows:
+        progress.rows += 1
+        try:
+            product, batch = cleaner.clean(row)
+        except ValidationError as exc:
+            progress.invalid += 1
+            if len(progress.errors) < MAX_REPORTED_ERRORS:
+                progress.errors.append(f'line {line}: {" ".join(exc.messages)}')
+            continue
+        products.append(product)
+        if batch is not None:
+            batches.append(batch)
+        if len(products) >= batch_size:
+            flush()
+            yield progress
+    if products:
+        flush()
+    if progress.products:
+        metrics.reconcile([metrics.PRODUCTS, metrics.LOW_STOCK, metrics.CATEGORIES])
+        caching.invalidate(caching.HOME)
+        reference.invalidate()
+    yield progress
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    """Yield catalog rows ({column: value}), one per product batch with units left"""
+    queryset = (queryset if queryset is not None else Product.objects.all()).select_related('category').prefetch_related(
+        Prefetch('batches', queryset=StockBatch.objects.filter(quantity__gt=0).order_by(*inventory.FEFO_ORDER)),
+    ).order_by('pk')
+    for product in queryset.iterator(chunk_size=chunk_size):
+        row = {name: getattr(product, name) for name in PRODUCT_FIELDS}
+        row['category'] = product.category.name
+        batches = list(product.batches.all()) or [None]
+        for batch in batches:
+            yield {
+                **row,
+                'batch_number': batch.batch_number if batch else '',
+                'expiry_date': batch.expiry_date if batch else None,
+                'stock': batch.quantity if batch else '',
+            }
+
+
+def write_rows(rows, stream, fmt):
+    """Serialize rows to a text stream, return how many were written"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({name: '' if value is None else value for name, value in row.items()})
+            count += 1
+        return count
+    for row in rows:
+        stream.write(json.dumps(row, default=str, ensure_ascii=False))
+        stream.write('\n')
+        count += 1
+    return count
@@ -1,8 +1,10 @@
+from .cartstore import get_cart
+
+
 def cart_context(request):
     """Add cart information to all templates"""
-    cart = request.session.get('cart', {})
-    cart_count = sum(cart.values()) if cart else 0
+    cart = get_cart(request)
     return {
-        'cart_count': cart_count,
-        'cart_items_count': len(cart)
-    }
\ No newline at end of file
+        'cart_count': cart.count,
+        'cart_items_count': cart.line_count,
+    }
@@ -0,0 +1,141 @@
+"""
+Coupon lookup, evaluation and redemption.
+
+lookup(code) finds an active coupon by its code. Coupons are looked up on
+every cart and checkout page, so the coupon (with the ids of the categories
+and products it is limited to) is cached for a minute, and so is the fact
+that a code does not exist. Saving or deleting a coupon, or changing its
+scope, drops the cached entry.
+
+evaluate(coupon, cart) checks a coupon against a resolved cart in one pass
+over its lines: a coupon limited to categories or products discounts, and
+needs its minimum amount from, the matching lines only.
+
+redeem(coupon, user) counts one use inside the order's transaction with a
+single conditional UPDATE, so concurrent checkouts can never redeem a coupon
+more than maximum_uses times, then enforces the per-customer limit.
+"""
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Coupon, Order
+
+LOOKUP_TIMEOUT = 60  # seconds
+
+CENT = Decimal('0.01')
+
+# Cached for codes that match no active coupon
+_MISSING = 'missing'
+
+
+def _cache_key(code):
+    return f'pharmacy:coupon:{code}'
+
+
+def with_scope(coupon):
+    """Attach the ids of the categories and products coupon is limited to"""
+    coupon.scope_category_ids = frozenset(
+        Coupon.categories.through.objects.filter(coupon=coupon).values_list('category_id', flat=True)
+    )
+    coupon.scope_product_ids = frozenset(
+        Coupon.products.through.objects.filter(coupon=coupon).values_list('product_id', flat=True)
+    )
+    return coupon
+
+
+def lookup(code):
+    """The active coupon with this code, None if there is none"""
+    if not isinstance(code, str) or not code:
+        return None
+    key = _cache_key(code)
+    coupon = cache.get(key)
+    if coupon is None:
+        coupon = Coupon.objects.filter(code=code, is_active=True).first()
+        coupon = with_scope(coupon) if coupon is not None else _MISSING
+        cache.set(key, coupon, LOOKUP_TIMEOUT)
+    return None if coupon == _MISSING else coupon
+
+
+def load(coupon_id):
+    """The coupon with this id straight from the database, scope included"""
+    coupon = Coupon.objects.filter(pk=coupon_id).first()
+    return with_scope(coupon) if coupon is not None else None
+
+
+def forget(code):
+    cache.delete(_cache_key(code))
+
+
+@dataclass
+class Evaluation:
+    coupon: Coupon
+    discount: Decimal = Decimal(0)
+    error: str = ''
+
+
+def evaluate(coupon, cart, now=None):
+    """What coupon is worth on a resolved cart; Evaluation.error says why it does not apply"""
+    now = now or timezone.now()
+    if not (coupon.is_active and coupon.valid_from <= now <= coupon.valid_to):
+        return Evaluation(coupon, error='This coupon is not valid or has expired.')
+    if coupon.used_count >= coupon.maximum_uses:
+        return Evaluation(coupon, error='This coupon has been fully redeemed.')
+
+    categories = getattr(coupon, 'scope_category_ids', None)
+    products = getattr(coupon, 'scope_product_ids', None)
+    if categories is None or products is None:
+        with_scope(coupon)
+        categories, products = coupon.scope_category_ids, coupon.scope_product_ids
+    scoped = bool(categories or products)
+
+    eligible = Decimal(0)
+    for item in cart.items:
+        if not scoped or item.product.pk in products or item.product.category_id in categories:
+            eligible += item.item_total
+
+    if scoped and not eligible:
+        return Evaluation(coupon, error='This coupon does not apply to any product in your cart.')
+    if eligible < coupon.minimum_amount:
+        what = 'eligible products' if scoped else 'your order'
+        return Evaluation(coupon, error=f'Spend at least {coupon.minimum_amount} on {what} to use this coupon.')
+
+    if coupon.discount_type == 'percentage':
+        discount = eligible * coupon.discount_value / 100
+    else:
+        discount = coupon.discount_value
+    return Evaluation(coupon, discount=min(discount, eligible).quantize(CENT, ROUND_HALF_UP))
+
+
+def uses_by(coupon, user):
+    """Orders user placed with coupon, cancelled ones aside"""
+    return Order.objects.filter(user=user, coupon=coupon).exclude(status='cancelled').count()
+
+
+def user_limit_reached(coupon, user):
+    return coupon.max_uses_per_user is not None and uses_by(coupon, user) >= coupon.max_uses_per_user
+
+
+def redeem(coupon, user, now=None):
+    """
+    Count one use of coupon by user, returning False if it cannot be redeemed.
+
+    Call inside the order's transaction and roll it back on False. The UPDATE
+    only matches while the coupon is active, in its validity window and under
+    maximum_uses; it also keeps the coupon row locked until commit, so orders
+    of the same customer are checked against max_uses_per_user one at a time.
+    """
+    now = now or timezone.now()
+    redeemed = Coupon.objects.filter(
+        pk=coupon.pk, is_active=True, valid_from__lte=now, valid_to__gte=now,
+        used_count__lt=F('maximum_uses'),
+    ).update(used_count=F('used_count') + 1)
+    if not redeemed or user_limit_reached(coupon, user):
+        return False
+    # Cached copies carry the old used_count
+    transaction.on_commit(lambda: forget(coupon.code))
+    return True
@@ -0,0 +1,83 @@
+"""
+Featured products ranking.
+
+rank_products() scores every active, in-stock product on is_featured,
+popularity, rating and stock health, and materializes the top of the list in
+the FeaturedProduct table. The home page only ever reads that small table.
+Run `manage.py rank_featured_products` on a schedule (e.g. every 15 minutes).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Ln
+from django.utils import timezone
+
+from . import caching
+from .models import FeaturedProduct, Product
+
+# How many ranked products to keep; more than the home page shows so that a
+# product selling out between runs does not leave a gap.
+POOL_SIZE = getattr(settings, 'PHARMACY_FEATURED_POOL_SIZE', 24)
+
+FEATURED_BOOST = 10.0
+PURCHASE_WEIGHT = 3.0
+VIEW_WEIGHT = 1.0
+RATING_WEIGHT = 1.0
+HEALTHY_STOCK_BONUS = 1.0
+
+
+def score_expression():
+    def as_float(value):
+        return Cast(value, FloatField())
+
+    return (
+        Case(When(is_featured=True, then=Value(FEATURED_BOOST)), default=Value(0.0), output_field=FloatField())
+        + PURCHASE_WEIGHT * Ln(as_float(F('purchase_count')) + 1)
+        + VIEW_WEIGHT * Ln(as_float(F('view_count')) + 1)
+        + RATING_WEIGHT * as_float(F('rating_avg'))
+        + Case(
+            When(stock__gt=F('min_stock_level'), then=Value(HEALTHY_STOCK_BONUS)),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
+
+
+def rank_products(pool_size=POOL_SIZE):
+    """Recompute the featured ranking, return the number of products ranked"""
+    ranked = list(
+        Product.objects.filter(is_active=True, stock__gt=0)
+        .annotate(featured_score=score_expression())
+        .order_by('-featured_score', 'pk')
+        .values_list('pk', 'featured_score')[:pool_size]
+    )
+    now = timezone.now()
+    with transaction.atomic():
+        FeaturedProduct.objects.all().delete()
+        FeaturedProduct.objects.bulk_create([
+            FeaturedProduct(product_id=product_id, rank=rank, score=score, computed_at=now)
+            for rank, (product_id, score) in enumerate(ranked, start=1)
+        ])
+    caching.invalidate(caching.HOME)
+    return len(ranked)
+
+
+def _ranked(limit):
+    return FeaturedProduct.objects.select_related('product').filter(product__is_active=True, product__stock__gt=0)[:limit]
+
+
+def _fallback(limit):
+    # Ranking never computed yet: flagged, then any, buyable products
+    return Product.objects.filter(is_active=True, stock__gt=0).order_by('-is_featured', 'pk')[:limit]
+
+
+def featured_products(limit=4):
+    """Top products from the precomputed ranking that are still buyable"""
+    products = [entry.product for entry in _ranked(limit)]
+    return products or list(_fallback(limit))
+
+
+async def afeatured_products(limit=4):
+    """featured_products() for async views"""
+    products = [entry.product async for entry in _ranked(limit)]
+    return products or [product async for product in _fallback(limit)]
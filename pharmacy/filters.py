@@ -0,0 +1,83 @@
+"""
+Listing filters shared by the storefront pages, their JSON pages and the API.
+
+Each helper takes the request's GET parameters and returns the filtered
+queryset. Parameters that cannot be parsed raise InvalidFilter, a BadRequest,
+so page views answer 400 without handling it; api.py turns it into its JSON
+error.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import BadRequest
+
+from .models import Doctor, Product
+from .pagination import PRODUCT_SORTS
+from .search import search_products
+
+
+class InvalidFilter(BadRequest):
+    pass
+
+
+def _id(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidFilter(f'{name} must be a number.') from None
+
+
+def _price(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise InvalidFilter(f'{name} must be an amount.') from None
+    if not price.is_finite():
+        raise InvalidFilter(f'{name} must be an amount.')
+    return price
+
+
+def filter_category(products, category_param):
+    """Products of a category given by id, or by (part of) its name"""
+    if not category_param:
+        return products
+    try:
+        return products.filter(category_id=int(category_param))
+    except ValueError:
+        return products.filter(category__name__icontains=category_param)
+
+
+def search_catalog(params):
+    """Apply advanced search filters from a GET dict, return (products, sort_by)"""
+    query = params.get('q', '')
+    category_id = _id(params, 'category')
+    min_price = _price(params, 'min_price')
+    max_price = _price(params, 'max_price')
+    sort_by = params.get('sort', 'relevance' if query else 'name')
+    if sort_by not in PRODUCT_SORTS or (sort_by == 'relevance' and not query):
+        sort_by = 'name'
+
+    products = Product.objects.filter(is_active=True).select_related('category')
+    if query:
+        products = search_products(query, products)
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    if min_price is not None:
+        products = products.filter(price__gte=min_price)
+    if max_price is not None:
+        products = products.filter(price__lte=max_price)
+    return products, sort_by
+
+
+def filter_doctors(params):
+    """Active doctors, of one specialization if one is asked for"""
+    doctors = Doctor.objects.filter(is_active=True).select_related('specialization')
+    specialization_id = _id(params, 'specialization')
+    if specialization_id is not None:
+        doctors = doctors.filter(specialization_id=specialization_id)
+    return doctors
@@ -0,0 +1,123 @@
+"""
+Idempotency keys for JSON endpoints that change state.
+
+A client that retries a request after a timeout cannot tell whether the first
+attempt was applied. If it sends the same `Idempotency-Key` header with
+every attempt, the endpoint applies the change once and answers the retries
+with the stored result of the first attempt:
+
+    key = idempotency.request_key(request)          # None without the header
+    result = idempotency.start(request, key, fingerprint)
+    if result is None:                              # first attempt: do the work
+        result = ...
+        idempotency.finish(request, key, fingerprint, result)
+
+Keys are scoped to the signed-in user (or to anonymous visitors as a whole,
+so they must be unguessable) and kept for a day in IdempotencyKey rows, whose
+unique (owner, key) constraint lets exactly one attempt claim a key no matter
+which worker process it reaches. Reusing a key for a different request
+(another fingerprint) is a 422; a retry that arrives while the first attempt
+is still running gets a 409. Fingerprints and results are stored as JSON.
+"""
+import json
+import re
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+TIMEOUT = 24 * 60 * 60  # seconds a result is replayed for
+PENDING_TIMEOUT = 60  # seconds an attempt may take before the key can be claimed again
+
+KEY_PATTERN = re.compile(r'[A-Za-z0-9_.:-]{16,128}')
+
+
+class IdempotencyError(Exception):
+    status = 400
+
+
+class KeyReused(IdempotencyError):
+    status = 422
+
+
+class InProgress(IdempotencyError):
+    status = 409
+
+
+def request_key(request):
+    """The request's idempotency key, None if it sent none"""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    if not KEY_PATTERN.fullmatch(key):
+        raise IdempotencyError(f'{HEADER} must be 16 to 128 letters, digits or "_.:-", e.g. a UUID.')
+    return key
+
+
+def _owner(request):
+    user = getattr(request, 'user', None)
+    return f'user{user.pk}' if user is not None and user.is_authenticated else 'anonymous'
+
+
+def _as_json(value):
+    """value as it reads back from a JSONField (tuples become lists, keys strings)"""
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def _expired(entry, now):
+    age = now - entry.claimed_at
+    if entry.result is None:
+        return age > timedelta(seconds=PENDING_TIMEOUT)
+    return age > timedelta(seconds=TIMEOUT)
+
+
+def start(request, key, fingerprint):
+    """
+    Claim key for this attempt, return None to go ahead.
+
+    Returns the stored result instead if an earlier attempt with the same key
+    finished, and raises KeyReused or InProgress (see above).
+    """
+    owner, fingerprint, now = _owner(request), _as_json(fingerprint), timezone.now()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(owner=owner, key=key, fingerprint=fingerprint, claimed_at=now)
+        return None
+    except IntegrityError:
+        pass
+    entry = IdempotencyKey.objects.filter(owner=owner, key=key).first()
+    if entry is None or _expired(entry, now):
+        # Released or long gone: claim it, unless another attempt just did
+        claimed = entry is not None and IdempotencyKey.objects.filter(
+            pk=entry.pk, claimed_at=entry.claimed_at,
+        ).update(fingerprint=fingerprint, result=None, claimed_at=now)
+        if claimed:
+            return None
+        raise InProgress('A request with this idempotency key is still being processed.')
+    if entry.fingerprint != fingerprint:
+        raise KeyReused('This idempotency key was already used for a different request.')
+    if entry.result is None:
+        raise InProgress('A request with this idempotency key is still being processed.')
+    return entry.result
+
+
+def finish(request, key, fingerprint, result):
+    """Store the result of the attempt that claimed key"""
+    IdempotencyKey.objects.filter(owner=_owner(request), key=key).update(
+        fingerprint=_as_json(fingerprint), result=_as_json(result), claimed_at=timezone.now(),
+    )
+
+
+def release(request, key):
+    """Give up the claim on key (the attempt failed), so a retry runs again"""
+    IdempotencyKey.objects.filter(owner=_owner(request), key=key).delete()
+
+
+def purge_expired():
+    """Delete keys whose results are no longer replayed, return the number deleted"""
+    cutoff = timezone.now() - timedelta(seconds=TIMEOUT)
+    return IdempotencyKey.objects.filter(claimed_at__lt=cutoff).delete()[0]
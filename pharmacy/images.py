@@ -0,0 +1,165 @@
+"""
+Image derivatives.
+
+When a product, gallery, doctor or banner image is uploaded, a background
+task (see tasks.py) writes resized copies next to the original
+(`products/foo.jpg` -> `products/foo__w320.webp`, `products/foo__w320.jpg`,
+...) in WebP, AVIF when the pillow-avif-plugin is installed, and the original
+format as a fallback. The `responsive_image`
+template tag then emits a <picture> with srcsets so browsers download the
+smallest variant that fits instead of the full upload. Derivatives are
+deleted along with the image they were made from (see signals.py).
+
+Whether an image has derivatives is remembered per process: for good once
+they exist, and for MISSING_TTL seconds while they do not, since a worker
+may be writing them.
+"""
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+try:  # AVIF support is optional
+    import pillow_avif  # noqa: F401
+    AVIF_SUPPORTED = True
+except ImportError:
+    AVIF_SUPPORTED = False
+
+WEBP_SUPPORTED = features.check('webp')
+
+# Widths (in CSS pixels at 1x/2x) generated for every image
+WIDTHS = getattr(settings, 'PHARMACY_IMAGE_WIDTHS', (160, 320, 640, 1024))
+QUALITY = {'webp': 80, 'avif': 60, 'jpg': 82}
+MISSING_TTL = getattr(settings, 'PHARMACY_IMAGE_MISSING_TTL', 60)  # seconds
+
+PIL_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF', 'jpg': 'JPEG', 'png': 'PNG'}
+CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+_known_ready = set()
+# name -> time.monotonic() of the last check that found no derivatives
+_known_missing = {}
+
+
+def modern_formats():
+    formats = []
+    if AVIF_SUPPORTED:
+        formats.append('avif')
+    if WEBP_SUPPORTED:
+        formats.append('webp')
+    return formats
+
+
+def fallback_format(name):
+    return 'png' if os.path.splitext(name)[1].lower() == '.png' else 'jpg'
+
+
+def derivative_name(name, width, fmt):
+    root, _ = os.path.splitext(name)
+    return f'{root}__w{width}.{fmt}'
+
+
+def has_derivatives(name, storage=default_storage):
+    """True once derivatives exist for name (both answers are memoized, see above)"""
+    if name in _known_ready:
+        return True
+    checked = _known_missing.get(name)
+    if checked is not None and time.monotonic() - checked < MISSING_TTL:
+        return False
+    if storage.exists(derivative_name(name, WIDTHS[-1], fallback_format(name))):
+        _known_ready.add(name)
+        _known_missing.pop(name, None)
+        return True
+    _known_missing[name] = time.monotonic()
+    return False
+
+
+def _encode(image, fmt):
+    if fmt == 'jpg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    options = {'optimize': True} if fmt in ('jpg', 'png') else {}
+    if fmt in QUALITY:
+        options['quality'] = QUALITY[fmt]
+    image.save(buffer, PIL_FORMATS[fmt], **options)
+    return buffer.getvalue()
+
+
+def generate_derivatives(fieldfile, force=False):
+    """Write every width/format variant of an uploaded image, return the names written"""
+    if not fieldfile or not fieldfile.name:
+        return []
+    storage = fieldfile.storage
+    name = fieldfile.name
+    # Look again rather than trust an earlier "no"
+    _known_missing.pop(name, None)
+    if not force and has_derivatives(name, storage):
+        return []
+
+    with storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        original = ImageOps.exif_transpose(original)
+        original.load()
+    if original.mode == 'P':
+        original = original.convert('RGBA')
+
+    written = []
+    formats = modern_formats() + [fallback_format(name)]
+    # Smallest first so the existence marker (largest fallback) is written last
+    for width in sorted(WIDTHS):
+        resized = original.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for fmt in formats:
+            target = derivative_name(name, width, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(_encode(resized, fmt)))
+            written.append(target)
+    _known_ready.add(name)
+    _known_missing.pop(name, None)
+    return written
+
+
+def delete_derivatives(name, storage=default_storage):
+    """Delete every variant written for name"""
+    for width in WIDTHS:
+        for fmt in modern_formats() + [fallback_format(name)]:
+            target = derivative_name(name, width, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+    _known_ready.discard(name)
+    _known_missing.pop(name, None)
+
+
+def sanitize(fieldfile):
+    """
+    Verify an uploaded image and return the name of an upright copy without metadata.
+
+    Phone photos of prescriptions carry EXIF (GPS position, device) that we
+    have no reason to keep. The clean copy is written next to the original
+    (`foo.jpg` -> `foo__clean.jpg`); the caller points its own record at the
+    copy and deletes the original once no other record shares it.
+    Raises PIL.UnidentifiedImageError for files that are not images.
+    """
+    storage = fieldfile.storage
+    name = fieldfile.name
+    with storage.open(name, 'rb') as source:
+        Image.open(source).verify()
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        fmt = image.format
+        has_metadata = bool(image.getexif())
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if not has_metadata:
+        return name
+    root, ext = os.path.splitext(name)
+    target = f'{root}__clean{ext}'
+    if storage.exists(target):  # Sanitized before for another record
+        return target
+    buffer = BytesIO()
+    image.save(buffer, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return storage.save(target, ContentFile(buffer.getvalue()))
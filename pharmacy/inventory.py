@@ -0,0 +1,138 @@
+"""
+Batch-level inventory.
+
+Stock is held in StockBatch rows, each with its own batch number and expiry
+date. Product.stock, Product.expiry_date and Product.batch_number are a
+maintained aggregate: the sellable (unexpired) units across all batches and
+the next batch to expire. Listing pages keep reading those columns and never
+sum batches on the fly; refresh_products() recomputes them with one UPDATE
+whenever batches change, and drops the cached home page when a product sells
+out or comes back in stock, since only buyable products are featured there.
+
+allocate() fills an order first-expiry-first-out. It reads and locks every
+candidate batch of the order in one SELECT ... FOR UPDATE, plans the whole
+allocation in memory and writes it back with one bulk UPDATE. On databases
+without row locks (SQLite) the transaction's write lock serializes checkouts
+instead.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from . import caching, metrics, monitoring
+from .models import Product, StockBatch
+
+FEFO_ORDER = (F('expiry_date').asc(nulls_last=True), 'pk')
+
+# Batch number for stock booked without one
+OPENING_BATCH = 'OPENING'
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f'Not enough stock for product {product_id}')
+
+
+def sellable_batches(today=None):
+    """Batches with units left that have not expired (a batch is not sold on its expiry date)"""
+    today = today or timezone.localdate()
+    return StockBatch.objects.filter(quantity__gt=0).exclude(expiry_date__lte=today)
+
+
+def aggregate_expressions(today=None):
+    """Product column values derived from its batches, for use in an UPDATE"""
+    sellable = sellable_batches(today).filter(product=OuterRef('pk'))
+    total = sellable.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    next_batch = sellable.order_by(*FEFO_ORDER)
+    return {
+        'stock': Coalesce(Subquery(total), 0),
+        'expiry_date': Subquery(next_batch.values('expiry_date')[:1]),
+        'batch_number': Coalesce(Subquery(next_batch.values('batch_number')[:1]), Value('')),
+        'updated_at': Now(),  # API ETags are derived from it
+    }
+
+
+def _stock_state(product_ids):
+    """{product_id: (in stock, (low stock, expiry date, batch number))}"""
+    return {
+        row[0]: (row[1], row[2:])
+        for row in Product.objects.filter(pk__in=product_ids).annotate(
+            in_stock=Case(When(stock__gt=0, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            low=Case(When(metrics.low_stock_filter(), then=Value(1)), default=Value(0), output_field=IntegerField()),
+        ).values_list('pk', 'in_stock', 'low', 'expiry_date', 'batch_number')
+    }
+
+
+def refresh_products(product_ids, **extra):
+    """
+    Recompute the stock aggregate of products from their batches (one UPDATE).
+
+    extra are additional column updates applied in the same statement. Low-stock
+    counters are adjusted, products whose alert state may have changed are
+    queued for the stock monitor, and the home page cache is invalidated when
+    any product sold out or came back in stock.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    before = _stock_state(product_ids)
+    Product.objects.filter(pk__in=product_ids).update(**aggregate_expressions(), **extra)
+    after = _stock_state(product_ids)
+
+    alerts_before = {pk: alerts for pk, (_, alerts) in before.items()}
+    alerts_after = {pk: alerts for pk, (_, alerts) in after.items()}
+    metrics.adjust(metrics.LOW_STOCK, sum(state[0] for state in alerts_after.values())
+                   - sum(state[0] for state in alerts_before.values()))
+    monitoring.stock_changed([pk for pk, state in alerts_after.items() if alerts_before.get(pk) != state])
+    if any(in_stock != before[pk][0] for pk, (in_stock, _) in after.items() if pk in before):
+        transaction.on_commit(lambda: caching.invalidate(caching.HOME))
+
+
+def allocate(quantities):
+    """
+    Take {product_id: quantity} from batches, first expiry first out.
+
+    Raises InsufficientStock (and changes nothing) when any product falls
+    short. Returns [(batch, quantity taken)]. Must run inside a transaction.
+    """
+    batches = (
+        sellable_batches()
+        .filter(product_id__in=quantities)
+        .select_for_update()
+        .order_by('product_id', *FEFO_ORDER)
+    )
+    remaining = dict(quantities)
+    taken = []
+    for batch in batches:
+        need = remaining[batch.product_id]
+        if not need:
+            continue
+        take = min(need, batch.quantity)
+        batch.quantity -= take
+        remaining[batch.product_id] -= take
+        taken.append((batch, take))
+
+    short = sorted(product_id for product_id, need in remaining.items() if need)
+    if short:
+        raise InsufficientStock(short[0])
+
+    StockBatch.objects.bulk_update([batch for batch, _ in taken], ['quantity'])
+    refresh_products(quantities, purchase_count=F('purchase_count') + Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0), output_field=IntegerField(),
+    ))
+    return taken
+
+
+def receive(product, quantity, batch_number, expiry_date=None):
+    """Book a delivery into a (new or existing) batch and refresh the product"""
+    batch, created = StockBatch.objects.get_or_create(
+        product=product, batch_number=batch_number,
+        defaults={'quantity': quantity, 'expiry_date': expiry_date},
+    )
+    if not created:
+        StockBatch.objects.filter(pk=batch.pk).update(quantity=F('quantity') + quantity)
+        refresh_products([product.pk])
+    return batch
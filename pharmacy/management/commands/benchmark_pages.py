@@ -0,0 +1,87 @@
+import asyncio
+import statistics
+import time
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.urls import URLPattern, include, path
+
+from pharmacy import async_views, urls, views
+from pharmacy.models import Product
+
+PAGES = ('home', 'product_list', 'product_detail', 'doctors')
+
+
+def page_urlconf(module):
+    """The project URLs with the read-heavy pages taken from module"""
+    patterns = [
+        URLPattern(pattern.pattern, getattr(module, pattern.callback.__name__), name=pattern.name)
+        if pattern.callback.__name__ in PAGES else pattern
+        for pattern in urls.urlpatterns
+    ]
+    return type('PageUrls', (), {'urlpatterns': [
+        path('admin/', admin.site.urls),
+        path('', include((patterns, 'pharmacy'))),
+    ]})
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the sync and async versions of the storefront pages under concurrent requests, '
+        'through the ASGI handler in this process'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request, repeatable (default: home, products, a product, doctors)')
+        parser.add_argument('--concurrency', type=int, default=16, help='Simultaneous requests')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per mode')
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        if not paths:
+            product_id = Product.objects.filter(is_active=True).values_list('pk', flat=True).first()
+            if product_id is None:
+                raise CommandError('No active products to request; import a catalog first.')
+            paths = ['/', '/products/', f'/product/{product_id}/', '/doctors/']
+        modes = ['sync', 'async'] if options['mode'] == 'both' else [options['mode']]
+
+        self.stdout.write(f'{options["requests"]} requests per mode, {options["concurrency"]} at a time')
+        self.stdout.write(f'{"mode":<6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for mode in modes:
+            urlconf = page_urlconf(views if mode == 'sync' else async_views)
+            with override_settings(ROOT_URLCONF=urlconf, ALLOWED_HOSTS=['testserver']):
+                latencies, errors, elapsed = asyncio.run(
+                    self.run(paths, options['concurrency'], options['requests']),
+                )
+            cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+            self.stdout.write(
+                f'{mode:<6} {len(latencies) / elapsed:>8.1f} {cuts[49] * 1000:>8.1f} {cuts[94] * 1000:>8.1f} '
+                f'{cuts[98] * 1000:>8.1f} {errors:>7}'
+            )
+
+    async def run(self, paths, concurrency, total):
+        client = AsyncClient()
+        # Warm the caches and the in-process reference data first
+        for url in paths:
+            await client.get(url)
+
+        latencies, errors = [], 0
+        requests = iter(range(total))
+
+        async def worker():
+            nonlocal errors
+            worker_client = AsyncClient()
+            for number in requests:
+                begin = time.monotonic()
+                response = await worker_client.get(paths[number % len(paths)])
+                if response.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.monotonic() - begin)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.monotonic() - started
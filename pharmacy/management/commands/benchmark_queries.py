@@ -0,0 +1,164 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from pharmacy.models import Category, Doctor, Notification, Order, Prescription, Product, Specialization
+from pharmacy.pagination import seek
+
+# Models whose Meta.indexes make up the composite index plan
+INDEXED_MODELS = [Product, Doctor, Prescription, Order, Notification]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with a large catalog and order history, then compare '
+        'query plans and latency of the listing queries with and without the composite indexes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query (median is reported)')
+
+    def handle(self, *args, **options):
+        # Never touch the configured database: build a disposable test one
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(options)
+            queries = self.queries(options)
+            self.drop_indexes()
+            without = self.measure(queries, options['repeat'])
+            started = time.monotonic()
+            self.create_indexes()
+            self.stdout.write(f'Built composite indexes in {time.monotonic() - started:.1f}s')
+            with_indexes = self.measure(queries, options['repeat'])
+            self.report(queries, without, with_indexes)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, options):
+        rng = random.Random(42)
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        categories = Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(50)])
+        specialization = Specialization.objects.create(name='General Medicine')
+        Doctor.objects.bulk_create([
+            Doctor(name=f'Doctor {i:05d}', specialization=specialization, license_number=f'LIC{i:06d}',
+                   phone='9999999999', email=f'doctor{i}@example.com', is_active=rng.random() < 0.9)
+            for i in range(5_000)
+        ], batch_size=batch_size)
+        users = User.objects.bulk_create([
+            User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(options['users'])
+        ], batch_size=batch_size)
+
+        for start in range(0, options['products'], batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=f'Product {i:07d}', slug=f'product-{i}', category=rng.choice(categories),
+                    description='Benchmark product', price=Decimal(rng.randint(100, 100_000)) / 100,
+                    mrp=Decimal('1000.00'), stock=rng.randint(0, 500), is_active=rng.random() < 0.9,
+                    is_featured=rng.random() < 0.01, rating_avg=Decimal(rng.randint(0, 500)) / 100,
+                )
+                for i in range(start, min(start + batch_size, options['products']))
+            ])
+        for start in range(0, options['orders'], batch_size):
+            Order.objects.bulk_create([
+                Order(user=rng.choice(users), order_number=f'BENCH{i:09d}', subtotal=Decimal('100.00'),
+                      total_price=Decimal('118.00'), status=rng.choice(Order.STATUS_CHOICES)[0])
+                for i in range(start, min(start + batch_size, options['orders']))
+            ])
+        side_rows = max(options['orders'] // 10, 1)
+        for start in range(0, side_rows, batch_size):
+            size = min(batch_size, side_rows - start)
+            Prescription.objects.bulk_create([
+                Prescription(user=rng.choice(users), image='prescriptions/bench.png', is_urgent=rng.random() < 0.1,
+                             status=rng.choice(Prescription.STATUS_CHOICES)[0])
+                for _ in range(size)
+            ])
+            Notification.objects.bulk_create([
+                Notification(user=rng.choice(users), title='Benchmark', message='Benchmark',
+                             notification_type='system', is_read=rng.random() < 0.7)
+                for _ in range(size)
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'Seeded database in {time.monotonic() - started:.1f}s')
+
+    def queries(self, options):
+        middle = options['products'] // 2
+        user = User.objects.order_by('pk').first()
+        category = Category.objects.order_by('pk').first()
+        page = 24
+        return [
+            ('product_list: first page by name', lambda: Product.objects.filter(
+                is_active=True).order_by('name', 'pk')[:page]),
+            ('product_list: deep keyset page', lambda: seek(
+                Product.objects.filter(is_active=True).order_by('name', 'pk'), 'name', False, f'Product {middle:07d}', 0
+            )[:page]),
+            ('product_list: category filter', lambda: Product.objects.filter(
+                category=category, is_active=True).order_by('name', 'pk')[:page]),
+            ('advanced_search: name', lambda: Product.objects.filter(is_active=True).order_by('name', 'pk')[:page]),
+            ('advanced_search: price_low', lambda: Product.objects.filter(is_active=True).order_by('price', 'pk')[:page]),
+            ('advanced_search: price_high', lambda: Product.objects.filter(is_active=True).order_by('-price', '-pk')[:page]),
+            ('advanced_search: newest', lambda: Product.objects.filter(is_active=True).order_by('-created_at', '-pk')[:page]),
+            ('advanced_search: rating', lambda: Product.objects.filter(is_active=True).order_by('-rating_avg', '-pk')[:page]),
+            ('doctors: first page', lambda: Doctor.objects.filter(is_active=True).order_by('name', 'pk')[:page]),
+            ('profile: recent orders', lambda: Order.objects.filter(user=user).order_by('-created_at')[:5]),
+            ('prescription review queue', lambda: Prescription.objects.filter(
+                status='pending').order_by('-is_urgent', 'uploaded_at')[:100]),
+            ('notifications: unread', lambda: Notification.objects.filter(
+                user=user, is_read=False).order_by('-created_at')[:20]),
+        ]
+
+    def measure(self, queries, repeat):
+        results = {}
+        for label, build in queries:
+            plan = build().explain()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(build())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = (statistics.median(timings), plan)
+        return results
+
+    def _each_index(self):
+        for model in INDEXED_MODELS:
+            for index in model._meta.indexes:
+                yield model, index
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self._each_index():
+                editor.remove_index(model, index)
+
+    def create_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self._each_index():
+                editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def report(self, queries, without, with_indexes):
+        self.stdout.write('')
+        self.stdout.write(f'{"query":<40} {"no index (ms)":>14} {"indexed (ms)":>13} {"speedup":>8}')
+        for label, _ in queries:
+            before, before_plan = without[label]
+            after, after_plan = with_indexes[label]
+            speedup = before / after if after else float('inf')
+            self.stdout.write(f'{label:<40} {before:>14.2f} {after:>13.2f} {speedup:>7.1f}x')
+        self.stdout.write('')
+        for label, _ in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for heading, results in (('without indexes', without), ('with indexes', with_indexes)):
+                self.stdout.write(f'  {heading}:')
+                for line in results[label][1].splitlines():
+                    self.stdout.write(f'    {line}')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy.images import generate_derivatives
+from pharmacy.models import Banner, Doctor, Product, ProductImage
+
+SOURCES = [(Product, 'image'), (ProductImage, 'image'), (Doctor, 'photo'), (Banner, 'photo')]
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive WebP/AVIF derivatives for images uploaded before the pipeline existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **options):
+        generated = failed = 0
+        for model, field in SOURCES:
+            queryset = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            for instance in queryset.only('pk', field).iterator():
+                fieldfile = getattr(instance, field)
+                try:
+                    if generate_derivatives(fieldfile, force=options['force']):
+                        generated += 1
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{fieldfile.name}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {generated} images ({failed} failed)'))
@@ -0,0 +1,41 @@
+import contextlib
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacy.catalog import FORMATS, detect_format, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Upsert products and stock batches from a CSV or JSON Lines distributor feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file, or - for standard input')
+        parser.add_argument('--format', choices=FORMATS, help='Feed format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows upserted per transaction')
+        parser.add_argument('--create-categories', action='store_true',
+                            help='Create categories the feed names instead of rejecting those rows')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path == '-' else detect_format(path))
+        try:
+            stream = contextlib.nullcontext(sys.stdin) if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with stream as feed:
+            rows = read_rows(feed, fmt)
+            for progress in import_rows(rows, batch_size=options['batch_size'],
+                                        create_categories=options['create_categories']):
+                self.stdout.write(f'  {progress.rows} rows, {progress.products} products, '
+                                  f'{progress.batches} stock batches ({progress.rate:.0f} rows/s)')
+
+        for error in progress.errors:
+            self.stderr.write(f'  {error}')
+        if progress.invalid > len(progress.errors):
+            self.stderr.write(f'  ... and {progress.invalid - len(progress.errors)} more invalid rows')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {progress.products} products and {progress.batches} stock batches from {progress.rows} rows '
+            f'({progress.invalid} invalid) at {progress.rate:.0f} rows/s'
+        ))
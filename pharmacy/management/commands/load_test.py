@@ -0,0 +1,93 @@
+import http.client
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = ['/', '/products/', '/api/v1/products/', '/api/v1/categories/']
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure requests per second and latency of a running server (runserver, gunicorn, ...) '
+        'with concurrent keep-alive clients'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to load')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help=f'Path to request, repeatable (default: {" ".join(DEFAULT_PATHS)})')
+        parser.add_argument('--concurrency', type=int, default=16, help='Simultaneous clients')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run for')
+        parser.add_argument('--warmup', type=float, default=1, help='Seconds of unmeasured requests first')
+
+    def handle(self, *args, **options):
+        target = urlsplit(options['url'])
+        if target.scheme not in ('http', 'https') or not target.hostname:
+            raise CommandError('--url must look like http://host:port')
+        paths = options['paths'] or DEFAULT_PATHS
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        started = time.monotonic()
+        measure_from = started + options['warmup']
+        deadline = measure_from + options['duration']
+
+        def client(offset):
+            connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(target.hostname, target.port, timeout=30)
+            own_latencies, own_errors = defaultdict(list), defaultdict(int)
+            request = offset
+            while True:
+                path = paths[request % len(paths)]
+                request += 1
+                begin = time.monotonic()
+                if begin >= deadline:
+                    break
+                try:
+                    connection.request('GET', path, headers={'Host': target.netloc})
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status < 400
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    ok = False
+                if begin < measure_from:
+                    continue
+                if ok:
+                    own_latencies[path].append(time.monotonic() - begin)
+                else:
+                    own_errors[path] += 1
+            connection.close()
+            with lock:
+                for path, values in own_latencies.items():
+                    latencies[path].extend(values)
+                for path, count in own_errors.items():
+                    errors[path] += count
+
+        self.stdout.write(f'Loading {options["url"]} with {options["concurrency"]} clients '
+                          f'for {options["duration"]:.0f}s...')
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - measure_from
+
+        self.stdout.write(f'{"path":<28} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for path in paths:
+            values = sorted(latencies[path])
+            if len(values) > 1:
+                cuts = statistics.quantiles(values, n=100)
+                p50, p95, p99 = (cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000)
+            else:
+                p50 = p95 = p99 = values[0] * 1000 if values else 0
+            self.stdout.write(f'{path:<28} {len(values) / elapsed:>8.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} '
+                              f'{errors[path]:>7}')
+        total = sum(len(values) for values in latencies.values())
+        failed = sum(errors.values())
+        self.stdout.write(self.style.SUCCESS(f'{total / elapsed:.1f} requests/s overall ({total} ok, {failed} failed)'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from pharmacy.models import StockAlert
+from pharmacy.monitoring import EXPIRY_WARNING_DAYS, scan
+
+
+class Command(BaseCommand):
+    help = 'Raise and resolve low-stock and expiry alerts; run on a schedule (e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=EXPIRY_WARNING_DAYS,
+                            help='Warn about batches expiring within this many days')
+
+    def handle(self, *args, **options):
+        raised = scan(warning_days=options['days'])
+        for alert in raised:
+            self.stdout.write(f'  new {alert.kind}: {alert.product.name} (stock {alert.stock_level})')
+        open_alerts = dict(
+            StockAlert.objects.filter(resolved_at__isnull=True).order_by().values_list('kind').annotate(count=Count('pk'))
+        )
+        summary = ', '.join(f'{open_alerts.get(kind, 0)} {label.lower()}' for kind, label in StockAlert.KIND_CHOICES)
+        self.stdout.write(self.style.SUCCESS(f'{len(raised)} new alerts; open: {summary}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy.featured import POOL_SIZE, rank_products
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed featured products ranking shown on the home page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help='Number of ranked products to keep')
+
+    def handle(self, *args, **options):
+        ranked = rank_products(pool_size=options['pool_size'])
+        self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} featured products'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pharmacy.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products indexed per INSERT batch')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        self.stdout.write(f'Rebuilding search index with {backend.__class__.__name__}...')
+        started = time.monotonic()
+        with transaction.atomic():
+            total = backend.rebuild(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} products in {elapsed:.2f}s'))
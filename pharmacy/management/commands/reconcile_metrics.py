@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy.metrics import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the admin dashboard metrics from scratch and correct any drift'
+
+    def handle(self, *args, **options):
+        drifted = reconcile()
+        for key, (stored, actual) in drifted.items():
+            self.stdout.write(f'{key}: {stored} -> {actual}')
+        self.stdout.write(self.style.SUCCESS(f'Reconciled dashboard metrics, {len(drifted)} corrected'))
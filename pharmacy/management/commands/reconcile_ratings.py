@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy.ratings import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = 'Backfill or reconcile the denormalized product rating aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products checked per batch')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reconciled rating aggregates, {fixed} products updated'))
@@ -0,0 +1,61 @@
+import multiprocessing
+import signal
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from pharmacy import idempotency, taskqueue, uploads
+
+
+def _work(threads, poll_interval, burst):
+    # Child processes started with "spawn" have not set Django up yet
+    django.setup()
+    import pharmacy.tasks  # noqa: F401  (registers the task handlers)
+    worker = taskqueue.Worker(threads=threads, poll_interval=poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    return worker.run(burst=burst)
+
+
+class Command(BaseCommand):
+    help = 'Run background tasks from the database queue (prescription processing, notifications, images)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Tasks run concurrently per process')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to start')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--purge-days', type=int, default=None,
+                            help='Delete finished tasks older than this many days, abandoned uploads and '
+                                 'expired idempotency keys, then exit')
+
+    def handle(self, *args, **options):
+        if options['purge_days'] is not None:
+            deleted = taskqueue.purge_finished(days=options['purge_days'])
+            partial = uploads.purge_partial_uploads()
+            keys = idempotency.purge_expired()
+            self.stdout.write(self.style.SUCCESS(
+                f'Deleted {deleted} finished tasks, {partial} abandoned uploads and {keys} idempotency keys'
+            ))
+            return
+
+        work = (options['threads'], options['poll_interval'], options['burst'])
+        if options['processes'] <= 1:
+            processed = _work(*work)
+            self.stdout.write(self.style.SUCCESS(f'Worker stopped after {processed} tasks'))
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        children = [multiprocessing.Process(target=_work, args=work) for _ in range(options['processes'])]
+        for child in children:
+            child.start()
+        self.stdout.write(f'Started {len(children)} worker processes x {options["threads"]} threads')
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+                child.join()
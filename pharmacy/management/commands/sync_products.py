@@ -0,0 +1,45 @@
+import contextlib
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacy.sync import apply_updates, summarize
+
+
+class Command(BaseCommand):
+    help = 'Apply ERP price/stock updates from a JSON array or JSON Lines file in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Update file, or - for standard input')
+        parser.add_argument('--verbose-results', action='store_true', help='Print the result of every row')
+
+    def read(self, stream):
+        text = stream.read()
+        try:
+            if text.lstrip().startswith('['):
+                return json.loads(text)
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        except ValueError as exc:
+            raise CommandError(f'Invalid JSON: {exc}')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            stream = contextlib.nullcontext(sys.stdin) if path == '-' else open(path, encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream as source:
+            rows = self.read(source)
+
+        started = time.monotonic()
+        results = apply_updates(rows)
+        elapsed = time.monotonic() - started
+
+        for result in results:
+            if options['verbose_results'] or result['status'] in ('not_found', 'invalid'):
+                errors = '; '.join(result.get('errors', []))
+                self.stdout.write(f"  {result['slug']}: {result['status']}{f' ({errors})' if errors else ''}")
+        counts = ', '.join(f'{count} {status}' for status, count in sorted(summarize(results).items()))
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(results)} rows in {elapsed:.2f}s: {counts or "nothing"}'))
@@ -0,0 +1,136 @@
+"""
+Admin dashboard metrics.
+
+The dashboard totals (products, orders, users, categories, revenue, pending
+prescriptions, low-stock products) live as precomputed rows in the Metric
+table, so the admin home page reads them with one small query instead of
+running COUNT(*)/SUM() over the big tables.
+
+Model signals (see signals.py) adjust the counters by the difference each
+saved or deleted row makes; code that changes rows with queryset.update()
+calls adjust() itself. Deltas are applied after the surrounding transaction
+commits, which keeps the hot counter rows out of checkout transactions.
+`manage.py reconcile_metrics` recomputes everything from scratch and should
+run on a schedule to correct any drift.
+"""
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Category, Metric, Order, Prescription, Product
+
+PRODUCTS = 'products'
+ORDERS = 'orders'
+USERS = 'users'
+CATEGORIES = 'categories'
+REVENUE = 'revenue'
+PENDING_PRESCRIPTIONS = 'pending_prescriptions'
+LOW_STOCK = 'low_stock'
+
+# Orders in these states do not count towards revenue
+NON_REVENUE_STATUSES = ('cancelled', 'returned')
+
+CENTS = Decimal('0.01')
+
+
+def low_stock_filter():
+    return Q(is_active=True, stock__lte=F('min_stock_level'))
+
+
+COMPUTE = {
+    PRODUCTS: lambda: Product.objects.count(),
+    ORDERS: lambda: Order.objects.count(),
+    USERS: lambda: User.objects.count(),
+    CATEGORIES: lambda: Category.objects.count(),
+    REVENUE: lambda: Order.objects.exclude(status__in=NON_REVENUE_STATUSES).aggregate(
+        total=Sum('total_price'))['total'] or Decimal('0'),
+    PENDING_PRESCRIPTIONS: lambda: Prescription.objects.filter(status='pending').count(),
+    LOW_STOCK: lambda: Product.objects.filter(low_stock_filter()).count(),
+}
+
+# Fields whose old values are needed to work out what a save changed
+TRACKED_FIELDS = {
+    Product: ('is_active', 'stock', 'min_stock_level'),
+    Order: ('status', 'total_price'),
+    Prescription: ('status',),
+    Category: (),
+    User: (),
+}
+
+
+def contributions(instance):
+    """{metric: amount} that one row adds to the totals"""
+    if isinstance(instance, Product):
+        low = instance.is_active and instance.stock <= instance.min_stock_level
+        return {PRODUCTS: 1, LOW_STOCK: int(low)}
+    if isinstance(instance, Order):
+        revenue = Decimal('0') if instance.status in NON_REVENUE_STATUSES else Decimal(str(instance.total_price))
+        return {ORDERS: 1, REVENUE: revenue}
+    if isinstance(instance, Prescription):
+        return {PENDING_PRESCRIPTIONS: int(instance.status == 'pending')}
+    if isinstance(instance, Category):
+        return {CATEGORIES: 1}
+    return {USERS: 1}
+
+
+def reconcile(keys=None):
+    """Recompute metrics from the tables, return {key: (stored, actual)} for those that drifted"""
+    now = timezone.now()
+    stored = dict(Metric.objects.values_list('key', 'value'))
+    drifted = {}
+    for key in keys or COMPUTE:
+        actual = Decimal(COMPUTE[key]()).quantize(CENTS)
+        if stored.get(key) != actual:
+            Metric.objects.update_or_create(key=key, defaults={'value': actual, 'updated_at': now})
+            drifted[key] = (stored.get(key), actual)
+    return drifted
+
+
+def adjust(key, delta):
+    """Add delta to a counter once the current transaction commits"""
+    if not delta:
+        return
+
+    def apply():
+        updated = Metric.objects.filter(key=key).update(value=F('value') + delta, updated_at=timezone.now())
+        if not updated:
+            reconcile([key])  # Never computed yet: the fresh total already includes delta
+    transaction.on_commit(apply)
+
+
+def snapshot(instance):
+    """Remember what a row contributed before it is saved"""
+    instance._metrics_snapshot = None
+    if instance._state.adding:
+        return
+    fields = TRACKED_FIELDS[type(instance)]
+    if not fields:
+        instance._metrics_snapshot = contributions(instance)
+        return
+    previous = type(instance).objects.filter(pk=instance.pk).only(*fields).first()
+    if previous is not None:
+        instance._metrics_snapshot = contributions(previous)
+
+
+def track_save(instance):
+    before = getattr(instance, '_metrics_snapshot', None) or {}
+    for key, amount in contributions(instance).items():
+        adjust(key, amount - before.get(key, 0))
+
+
+def track_delete(instance):
+    for key, amount in contributions(instance).items():
+        adjust(key, -amount)
+
+
+def values():
+    """All dashboard metrics as {key: Decimal}; computes any that are missing"""
+    current = dict(Metric.objects.values_list('key', 'value'))
+    missing = [key for key in COMPUTE if key not in current]
+    if missing:
+        reconcile(missing)
+        current.update(Metric.objects.filter(key__in=missing).values_list('key', 'value'))
+    return current
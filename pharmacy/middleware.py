@@ -0,0 +1,31 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class CartMiddleware:
+    """Writes back the cookie of an anonymous cart that changed (see cartstore.py)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.save(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.save(request, response)
+        return response
+
+    @staticmethod
+    def save(request, response):
+        store = getattr(request, '_cart_store', None)
+        if store is not None:
+            store.write_cookie(response)
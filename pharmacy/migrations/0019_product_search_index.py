@@ -0,0 +1,54 @@
+# Generated manually to add the full-text product search index
+
+from django.db import migrations
+
+SEARCH_COLUMNS = ['name', 'brand', 'manufacturer', 'ingredients', 'uses', 'description']
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    columns = ', '.join(SEARCH_COLUMNS)
+    select_columns = ', '.join(f"COALESCE({column}, '')" for column in SEARCH_COLUMNS)
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS pharmacy_product_fts USING fts5("
+            f"{columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO pharmacy_product_fts (rowid, {columns}) "
+            f"SELECT id, {select_columns} FROM pharmacy_product"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE pharmacy_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(brand, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(ingredients, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(manufacturer, '')), 'C') || "
+            "setweight(to_tsvector('english', coalesce(uses, '')), 'C') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'D')"
+            ") STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX pharmacy_product_search_gin ON pharmacy_product USING GIN (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS pharmacy_product_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS pharmacy_product_search_gin")
+        schema_editor.execute("ALTER TABLE pharmacy_product DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0018_add_userprofile_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,56 @@
+# Generated manually to denormalize product rating aggregates
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('pharmacy', 'Product')
+    Review = apps.get_model('pharmacy', 'Review')
+    ProductComment = apps.get_model('pharmacy', 'ProductComment')
+
+    totals = {}
+    sources = [Review.objects.filter(is_approved=True), ProductComment.objects.all()]
+    for queryset in sources:
+        rows = queryset.values('product_id').annotate(
+            total=models.Sum('rating'), count=models.Count('id')
+        ).order_by()
+        for row in rows:
+            rating_sum, rating_count = totals.get(row['product_id'], (0, 0))
+            totals[row['product_id']] = (rating_sum + row['total'], rating_count + row['count'])
+
+    products = []
+    for product in Product.objects.filter(pk__in=totals):
+        product.rating_sum, product.rating_count = totals[product.pk]
+        product.rating_avg = (Decimal(product.rating_sum) / product.rating_count).quantize(
+            Decimal('0.01'), ROUND_HALF_UP
+        )
+        products.append(product)
+    Product.objects.bulk_update(products, ['rating_sum', 'rating_count', 'rating_avg'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0019_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(max_digits=3, decimal_places=2, default=0),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
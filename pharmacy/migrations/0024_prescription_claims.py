@@ -0,0 +1,26 @@
+# Generated manually to let pharmacists claim prescriptions from the review queue
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0023_task'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prescription',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, help_text='Pharmacist currently reviewing it', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_prescriptions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
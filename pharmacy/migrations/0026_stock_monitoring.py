@@ -0,0 +1,39 @@
+# Generated manually to add stock alerts and the low-stock/expiry indexes
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0025_metric'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('stock__lte', models.F('min_stock_level'))), fields=['stock', 'id'], name='product_low_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('expiry_date__isnull', False), ('is_active', True)), fields=['expiry_date', 'id'], name='product_expiry_idx'),
+        ),
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('low_stock', 'Low stock'), ('expiring', 'Expiring soon'), ('expired', 'Expired')], max_length=20)),
+                ('batch_number', models.CharField(blank=True, max_length=50)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('stock_level', models.PositiveIntegerField(help_text='Stock when the alert was raised')),
+                ('raised_at', models.DateTimeField()),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='pharmacy.product')),
+            ],
+            options={
+                'ordering': ['-raised_at'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('resolved_at__isnull', True)), fields=('product', 'kind', 'batch_number'), name='stockalert_open_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated manually to add stock batches and open one batch per stocked product
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_batches(apps, schema_editor):
+    Product = apps.get_model('pharmacy', 'Product')
+    StockBatch = apps.get_model('pharmacy', 'StockBatch')
+    products = Product.objects.filter(stock__gt=0).values_list('pk', 'stock', 'batch_number', 'expiry_date')
+    batches = [
+        StockBatch(product_id=pk, quantity=stock, batch_number=batch_number or 'OPENING', expiry_date=expiry_date)
+        for pk, stock, batch_number, expiry_date in products.iterator(chunk_size=1000)
+    ]
+    StockBatch.objects.bulk_create(batches, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0026_stock_monitoring'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='stock',
+            field=models.PositiveIntegerField(default=0, help_text='Sellable units across all batches'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='expiry_date',
+            field=models.DateField(blank=True, help_text='Expiry of the next batch to sell', null=True),
+        ),
+        migrations.CreateModel(
+            name='StockBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(max_length=50)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.PositiveIntegerField(help_text='Units left in this batch')),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='pharmacy.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Stock batches',
+                'ordering': ['expiry_date', 'id'],
+                'indexes': [models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date', 'id'], name='stockbatch_fefo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'batch_number'), name='stockbatch_product_batch_unique')],
+            },
+        ),
+        migrations.RunPython(open_batches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated manually to scope coupons to categories or products and limit uses per customer
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0028_cartline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses_per_user',
+            field=models.PositiveIntegerField(blank=True, help_text='Leave empty for no per-customer limit', null=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='categories',
+            field=models.ManyToManyField(blank=True, help_text='Only discount products in these categories', related_name='+', to='pharmacy.category'),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='products',
+            field=models.ManyToManyField(blank=True, help_text='Only discount these products', related_name='+', to='pharmacy.product'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated manually to keep idempotency keys in the database, shared by every worker process
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0029_coupon_scope_and_user_limit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(help_text='user<id> or anonymous', max_length=40)),
+                ('key', models.CharField(max_length=128)),
+                ('fingerprint', models.JSONField()),
+                ('result', models.JSONField(blank=True, help_text='Empty while the request is running', null=True)),
+                ('claimed_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('owner', 'key'), name='idempotencykey_owner_key_unique')],
+                'indexes': [models.Index(fields=['claimed_at'], name='idempotencykey_claimed_idx')],
+            },
+        ),
+    ]
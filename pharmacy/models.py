@@ -28,6 +28,11 @@ class Doctor(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='doctor_active_name_idx', condition=models.Q(is_active=True)),
+        ]
+
     def __str__(self):
         return f"Dr. {self.name} - {self.specialization.name}"
 
@@ -41,14 +46,15 @@ class Product(models.Model):
     short_description = models.CharField(max_length=500, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     mrp = models.DecimalField(max_digits=10, decimal_places=2, help_text='Maximum Retail Price')
-    stock = models.PositiveIntegerField()
+    stock = models.PositiveIntegerField(default=0, help_text='Sellable units across all batches')
     min_stock_level = models.PositiveIntegerField(default=10)
     is_prescription = models.BooleanField(default=False)
     is_featured = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     weight = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True, help_text='Weight in grams')
     dimensions = models.CharField(max_length=100, blank=True, help_text='L x W x H in cm')
-    expiry_date = models.DateField(null=True, blank=True)
+    # Stock, expiry and batch are maintained from StockBatch rows by pharmacy.inventory
+    expiry_date = models.DateField(null=True, blank=True, help_text='Expiry of the next batch to sell')
     batch_number = models.CharField(max_length=50, blank=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
     
@@ -70,9 +76,33 @@ class Product(models.Model):
     view_count = models.PositiveIntegerField(default=0)
     purchase_count = models.PositiveIntegerField(default=0)
     
+    # Denormalized rating aggregates, maintained by pharmacy.ratings
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination: every listing orders by (sort key, id). The
+            # storefront only lists active products, so those indexes are
+            # partial, which also lets SQLite match Django's bare
+            # `WHERE is_active` against them.
+            models.Index(fields=['name', 'id'], name='product_active_name_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['price', 'id'], name='product_active_price_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['created_at', 'id'], name='product_active_created_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['rating_avg', 'id'], name='product_active_rating_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['category', 'name', 'id'], name='product_category_active_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['-is_featured', 'id'], name='product_featured_idx', condition=models.Q(is_active=True)),
+            # Stock monitoring (see monitoring.py): only the rows worth an alert
+            models.Index(fields=['stock', 'id'], name='product_low_stock_idx',
+                         condition=models.Q(is_active=True, stock__lte=models.F('min_stock_level'))),
+            models.Index(fields=['expiry_date', 'id'], name='product_expiry_idx',
+                         condition=models.Q(is_active=True, expiry_date__isnull=False)),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.slug:
             from django.utils.text import slugify
@@ -87,9 +117,8 @@ class Product(models.Model):
 
     @property
     def average_rating(self):
-        reviews = self.reviews.filter(is_approved=True)
-        if reviews.exists():
-            return round(reviews.aggregate(models.Avg('rating'))['rating__avg'], 1)
+        if self.rating_count:
+            return round(float(self.rating_avg), 1)
         return 0
 
     @property
@@ -99,6 +128,19 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+class FeaturedProduct(models.Model):
+    """Precomputed home page ranking, rebuilt by `manage.py rank_featured_products`"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='featured_rank')
+    rank = models.PositiveIntegerField(db_index=True)
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['rank']
+
+    def __str__(self):
+        return f"#{self.rank} {self.product.name}"
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
@@ -165,6 +207,15 @@ class Prescription(models.Model):
     reviewed_at = models.DateTimeField(null=True, blank=True)
     reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviewed_prescriptions')
     notes = models.TextField(blank=True, help_text='Admin notes')
+    claimed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='claimed_prescriptions', help_text='Pharmacist currently reviewing it')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Review queue: pending first by urgency, then oldest first
+            models.Index(fields=['status', '-is_urgent', 'uploaded_at'], name='prescription_queue_idx'),
+            models.Index(fields=['user', 'uploaded_at'], name='prescription_user_idx'),
+        ]
 
     def __str__(self):
         return f"Prescription by {self.patient_name} - Dr. {self.doctor_name}"
@@ -202,6 +253,12 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.order_number:
             import uuid
@@ -247,6 +304,9 @@ class Coupon(models.Model):
     minimum_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     maximum_uses = models.PositiveIntegerField(default=1)
     used_count = models.PositiveIntegerField(default=0)
+    max_uses_per_user = models.PositiveIntegerField(null=True, blank=True, help_text='Leave empty for no per-customer limit')
+    categories = models.ManyToManyField(Category, blank=True, related_name='+', help_text='Only discount products in these categories')
+    products = models.ManyToManyField(Product, blank=True, related_name='+', help_text='Only discount these products')
     valid_from = models.DateTimeField()
     valid_to = models.DateTimeField()
     is_active = models.BooleanField(default=True)
@@ -351,6 +411,137 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='notification_user_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='notification_user_unread_idx', condition=models.Q(is_read=False)),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.title}"
+
+
+class Task(models.Model):
+    """Background job picked up by `manage.py run_worker` (see tasks.py)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, help_text='Registered task name')
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0, help_text='Higher runs first')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(help_text='Not picked up before this time')
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for the next due task: highest priority, then oldest
+            models.Index(fields=['-priority', 'run_at', 'id'], name='task_queue_idx', condition=models.Q(status='queued')),
+            models.Index(fields=['status', 'locked_at'], name='task_status_locked_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+class Metric(models.Model):
+    """Precomputed admin dashboard total (see metrics.py)"""
+    key = models.CharField(max_length=50, unique=True)
+    value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+class StockAlert(models.Model):
+    """Open or resolved inventory alert raised by the stock monitor (see monitoring.py)"""
+    KIND_CHOICES = [
+        ('low_stock', 'Low stock'),
+        ('expiring', 'Expiring soon'),
+        ('expired', 'Expired'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_alerts')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    batch_number = models.CharField(max_length=50, blank=True)
+    expiry_date = models.DateField(null=True, blank=True)
+    stock_level = models.PositiveIntegerField(help_text='Stock when the alert was raised')
+    raised_at = models.DateTimeField()
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-raised_at']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind', 'batch_number'], name='stockalert_open_unique',
+                                    condition=models.Q(resolved_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.product.name}"
+
+
+class StockBatch(models.Model):
+    """Units of a product received under one batch number (see inventory.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='batches')
+    batch_number = models.CharField(max_length=50)
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity = models.PositiveIntegerField(help_text='Units left in this batch')
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['expiry_date', 'id']
+        verbose_name_plural = 'Stock batches'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'batch_number'], name='stockbatch_product_batch_unique'),
+        ]
+        indexes = [
+            # First-expiry-first-out allocation only looks at batches with units left
+            models.Index(fields=['product', 'expiry_date', 'id'], name='stockbatch_fefo_idx',
+                         condition=models.Q(quantity__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.batch_number}"
+
+
+class CartLine(models.Model):
+    """One product in a signed-in customer's cart (see cartstore.py)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField(default=1)
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['added_at', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='cartline_user_product_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.product.name} x {self.quantity}"
+
+
+class IdempotencyKey(models.Model):
+    """An Idempotency-Key a client sent and the result of its request (see idempotency.py)"""
+    owner = models.CharField(max_length=40, help_text='user<id> or anonymous')
+    key = models.CharField(max_length=128)
+    fingerprint = models.JSONField()
+    result = models.JSONField(null=True, blank=True, help_text='Empty while the request is running')
+    claimed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='idempotencykey_owner_key_unique'),
+        ]
+        indexes = [models.Index(fields=['claimed_at'], name='idempotencykey_claimed_idx')]
 
     def __str__(self):
-        return f"{self.user.username} - {self.title}"
\ No newline at end of file
+        return f"{self.owner}: {self.key}"
@@ -0,0 +1,178 @@
+"""
+Low-stock and expiry monitoring.
+
+Alerts are StockAlert rows: at most one open alert per product, kind and
+batch, resolved (not deleted) once the condition clears. They are evaluated
+incrementally:
+
+- saving a product re-evaluates that product (see signals.py);
+- batch changes and checkouts update the stock aggregate with UPDATEs, so
+  inventory.refresh_products() reports the products whose low-stock state or
+  next batch changed and a background task re-evaluates just those;
+- `manage.py monitor_stock`, run on a schedule (e.g. hourly), drops batches
+  that expired since the last run from the stock aggregate, picks up products
+  entering the expiry window and sweeps anything missed. It collects the
+  candidates with one query per partial index (product_low_stock_idx,
+  product_expiry_idx, stockbatch_fefo_idx and the open alerts'
+  stockalert_open_unique) and then loads them by primary key, never reading
+  the whole catalog.
+
+Expiring-soon alerts follow the product's next batch to sell; expired alerts
+are raised for every batch that still has units on the shelf.
+
+Newly raised alerts are sent to staff as one summary Notification.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .metrics import low_stock_filter
+from .models import Product, StockAlert, StockBatch
+
+EXPIRY_WARNING_DAYS = getattr(settings, 'PHARMACY_EXPIRY_WARNING_DAYS', 90)
+
+WATCHED_FIELDS = ('name', 'is_active', 'stock', 'min_stock_level', 'expiry_date', 'batch_number')
+
+
+def expired_batches(product_ids, today):
+    """Batches past their expiry that still hold units"""
+    return StockBatch.objects.filter(product__in=product_ids, quantity__gt=0, expiry_date__lte=today)
+
+
+def expected_alerts(product, today, warning_days=EXPIRY_WARNING_DAYS, expired=()):
+    """
+    {(kind, batch_number): expiry_date} of the alerts a product should have open.
+
+    expired are the product's expired batches that still hold units.
+    """
+    if not product.is_active:
+        return {}
+    alerts = {}
+    if product.stock <= product.min_stock_level:
+        alerts[('low_stock', '')] = None
+    if product.expiry_date and product.stock > 0:
+        if product.expiry_date <= today:
+            alerts[('expired', product.batch_number)] = product.expiry_date
+        elif product.expiry_date <= today + datetime.timedelta(days=warning_days):
+            alerts[('expiring', product.batch_number)] = product.expiry_date
+    for batch in expired:
+        alerts[('expired', batch.batch_number)] = batch.expiry_date
+    return alerts
+
+
+def evaluate(products, warning_days=EXPIRY_WARNING_DAYS):
+    """Raise and resolve alerts for products, return the newly raised alerts"""
+    products = list(products)
+    if not products:
+        return []
+    now = timezone.now()
+    today = timezone.localdate()
+    open_alerts = {
+        (alert.product_id, alert.kind, alert.batch_number): alert.pk
+        for alert in StockAlert.objects.filter(product__in=products, resolved_at__isnull=True)
+    }
+    expired = {}
+    for batch in expired_batches(products, today):
+        expired.setdefault(batch.product_id, []).append(batch)
+    wanted = {}
+    for product in products:
+        alerts = expected_alerts(product, today, warning_days, expired.get(product.pk, ()))
+        for (kind, batch_number), expiry_date in alerts.items():
+            wanted[(product.pk, kind, batch_number)] = (product, expiry_date)
+
+    stale = [pk for key, pk in open_alerts.items() if key not in wanted]
+    if stale:
+        StockAlert.objects.filter(pk__in=stale).update(resolved_at=now)
+    missing = [
+        StockAlert(product=product, kind=kind, batch_number=batch_number, expiry_date=expiry_date,
+                   stock_level=product.stock, raised_at=now)
+        for (product_id, kind, batch_number), (product, expiry_date) in wanted.items()
+        if (product_id, kind, batch_number) not in open_alerts
+    ]
+    if not missing:
+        return []
+    # A concurrent check may have raised the same alert; the partial unique
+    # constraint keeps one. Only the rows stamped with our raised_at are ours.
+    StockAlert.objects.bulk_create(missing, ignore_conflicts=True)
+    raised = []
+    for alert in StockAlert.objects.filter(
+        product__in={alert.product_id for alert in missing}, resolved_at__isnull=True, raised_at=now,
+    ):
+        key = (alert.product_id, alert.kind, alert.batch_number)
+        if key in wanted:
+            alert.product = wanted[key][0]
+            raised.append(alert)
+    return raised
+
+
+def check_products(product_ids):
+    """Re-evaluate the given products and notify staff about new alerts"""
+    raised = evaluate(Product.objects.filter(pk__in=product_ids).only(*WATCHED_FIELDS))
+    notify(raised)
+    return raised
+
+
+def stock_changed(product_ids):
+    """Queue a re-evaluation of products whose stock changed via UPDATE"""
+    from .taskqueue import enqueue
+    from .tasks import check_stock
+
+    if product_ids:
+        enqueue(check_stock, {'product_ids': sorted(product_ids)})
+
+
+def scan(warning_days=EXPIRY_WARNING_DAYS):
+    """
+    Scheduled sweep: evaluate every product that has, or should have, an open alert.
+
+    Returns the newly raised alerts.
+    """
+    from .inventory import refresh_products
+
+    today = timezone.localdate()
+    # Products with expired units; their aggregate may still count them as the next batch
+    expired_ids = set(
+        StockBatch.objects.filter(quantity__gt=0, expiry_date__lte=today).order_by()
+        .values_list('product_id', flat=True)
+    )
+    refresh_products(expired_ids)
+
+    # One query per partial index: OR-ing them makes the planner scan the product table
+    horizon = today + datetime.timedelta(days=warning_days)
+    candidate_ids = set(expired_ids)
+    candidate_ids.update(Product.objects.filter(low_stock_filter()).values_list('pk', flat=True))
+    candidate_ids.update(Product.objects.filter(
+        is_active=True, expiry_date__isnull=False, expiry_date__lte=horizon,
+    ).values_list('pk', flat=True))
+    candidate_ids.update(
+        StockAlert.objects.filter(resolved_at__isnull=True).order_by().values_list('product_id', flat=True)
+    )
+
+    raised = []
+    candidate_ids = sorted(candidate_ids)
+    for start in range(0, len(candidate_ids), 1000):
+        chunk = candidate_ids[start:start + 1000]
+        raised += evaluate(Product.objects.filter(pk__in=chunk).only(*WATCHED_FIELDS), warning_days)
+    notify(raised)
+    return raised
+
+
+def notify(raised):
+    """One summary Notification per staff member for a set of new alerts"""
+    if not raised:
+        return
+    from .taskqueue import HIGH, NORMAL, enqueue
+    from .tasks import notify_staff
+
+    labels = dict(StockAlert.KIND_CHOICES)
+    lines = [f'{labels[alert.kind]}: {alert.product.name}' for alert in raised[:10]]
+    if len(raised) > 10:
+        lines.append(f'... and {len(raised) - 10} more')
+    urgent = any(alert.kind == 'expired' for alert in raised)
+    enqueue(notify_staff, {
+        'title': f'{len(raised)} new stock alert{"s" if len(raised) != 1 else ""}',
+        'message': '\n'.join(lines),
+        'notification_type': 'system',
+        'action_url': '/admin/pharmacy/stockalert/?resolved_at__isnull=True',
+    }, priority=HIGH if urgent else NORMAL)
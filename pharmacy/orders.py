@@ -0,0 +1,95 @@
+"""
+Order placement.
+
+place_order() turns a cart into an Order in a single transaction:
+stock is taken from the product batches first-expiry-first-out by
+inventory.allocate(), which locks all of the order's batches with one query
+(so concurrent buyers of the same SKU can never oversell it), the coupon is
+redeemed with one conditional UPDATE (coupons.redeem), and the order lines
+are written with one bulk INSERT. Any failure rolls the whole order back.
+"""
+from dataclasses import dataclass
+
+from django.db import transaction
+
+from . import coupons, inventory
+from .cart import price_cart, resolve_cart
+from .models import Order, OrderItem, OrderStatus
+
+
+class OrderError(Exception):
+    """The order could not be placed; the message is safe to show to the customer"""
+
+
+class OutOfStock(OrderError):
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f'Sorry, {product.name} does not have enough stock left.')
+
+
+class CouponUnavailable(OrderError):
+    def __init__(self, coupon):
+        self.coupon = coupon
+        super().__init__(f'Coupon {coupon.code} is no longer valid.')
+
+
+@dataclass
+class ShippingDetails:
+    address: str
+    phone: str
+    email: str
+    billing_address: str = ''
+    notes: str = ''
+
+
+def reserve_stock(cart):
+    """Take every cart line from stock (see inventory.allocate), or raise OutOfStock"""
+    quantities = {}
+    for item in cart.items:
+        quantities[item.product.pk] = quantities.get(item.product.pk, 0) + item.quantity
+    try:
+        inventory.allocate(quantities)
+    except inventory.InsufficientStock as exc:
+        raise OutOfStock(next(item.product for item in cart.items if item.product.pk == exc.product_id))
+
+
+def place_order(user, lines, shipping, coupon_id=None, payment_method=None):
+    """Create and return an Order for the {product_id: quantity} lines, raising OrderError on failure"""
+    with transaction.atomic():
+        cart = resolve_cart(lines)
+        if not cart:
+            raise OrderError('Your cart is empty!')
+
+        coupon = coupons.load(coupon_id) if coupon_id else None
+        if coupon_id and coupon is None:
+            raise OrderError('This coupon is no longer valid.')
+        totals = price_cart(cart, coupon)
+        if coupon is not None and totals.coupon is None:
+            # Used up or expired since the customer saw the discount
+            raise CouponUnavailable(coupon)
+
+        reserve_stock(cart)
+        if totals.coupon is not None and not coupons.redeem(totals.coupon, user):
+            raise CouponUnavailable(totals.coupon)
+
+        order = Order.objects.create(
+            user=user,
+            subtotal=totals.subtotal,
+            tax_amount=totals.tax_amount,
+            shipping_cost=totals.shipping_cost,
+            discount_amount=totals.discount_amount,
+            total_price=totals.total_amount,
+            coupon=totals.coupon,
+            payment_method=payment_method,
+            shipping_address=shipping.address,
+            billing_address=shipping.billing_address or shipping.address,
+            phone=shipping.phone,
+            email=shipping.email,
+            notes=shipping.notes,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=item.product, quantity=item.quantity, price=item.product.price)
+            for item in cart.items
+        ])
+        OrderStatus.objects.create(order=order, status=order.status, notes='Order placed', created_by=user)
+    return order
@@ -0,0 +1,123 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, every page remembers the (sort key, id) of its last row and
+the next page starts strictly after it. The query for page 500 then costs the
+same as the query for page 1 as long as the sort key is indexed.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+
+PAGE_SIZE = getattr(settings, 'PHARMACY_PAGE_SIZE', 24)
+MAX_PAGE_SIZE = 100
+
+# sort option -> (ordering field, descending)
+PRODUCT_SORTS = {
+    'name': ('name', False),
+    'price_low': ('price', False),
+    'price_high': ('price', True),
+    'rating': ('rating_avg', True),
+    'newest': ('created_at', True),
+    'relevance': ('search_rank', False),
+}
+
+_CURSOR_SALT = 'pharmacy.pagination'
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = ''
+    page_size: int = PAGE_SIZE
+
+    @property
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _serialize(value):
+    if isinstance(value, (Decimal, float)):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(sort_value, pk):
+    return signing.dumps([_serialize(sort_value), pk], salt=_CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """Return (sort value, id) from a cursor, or None if it is missing or tampered with"""
+    if not cursor:
+        return None
+    try:
+        sort_value, pk = signing.loads(cursor, salt=_CURSOR_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return sort_value, pk
+
+
+def parse_page_size(value, default=PAGE_SIZE):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def seek(queryset, field, descending, sort_value, pk):
+    """Restrict queryset to rows strictly after (sort_value, pk) in (field, id) order"""
+    after = 'lt' if descending else 'gt'
+    from_value = 'lte' if descending else 'gte'
+    # The redundant range on field alone lets the database start an index
+    # range scan at the cursor instead of evaluating the OR for every row.
+    return queryset.filter(**{f'{field}__{from_value}': sort_value}).filter(
+        Q(**{f'{field}__{after}': sort_value}) | Q(**{field: sort_value, f'pk__{after}': pk})
+    )
+
+
+def keyset(queryset, field, descending=False, cursor=None):
+    """queryset ordered by (field, id), starting after the cursor position"""
+    direction = '-' if descending else ''
+    queryset = queryset.order_by(f'{direction}{field}', f'{direction}pk')
+    position = decode_cursor(cursor)
+    if position is not None:
+        queryset = seek(queryset, field, descending, *position)
+    return queryset
+
+
+def paginate(queryset, field, descending=False, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return one KeysetPage of queryset ordered by (field, id).
+
+    field must be a non-null column or annotation on queryset; ties are broken
+    by primary key in the same direction so the ordering is total.
+    """
+    rows = list(keyset(queryset, field, descending, cursor)[:page_size + 1])
+    return _page(rows, field, page_size)
+
+
+async def apaginate(queryset, field, descending=False, cursor=None, page_size=PAGE_SIZE):
+    """paginate() for async views"""
+    rows = [row async for row in keyset(queryset, field, descending, cursor)[:page_size + 1]]
+    return _page(rows, field, page_size)
+
+
+def _page(rows, field, page_size):
+    next_cursor = ''
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(items=rows, next_cursor=next_cursor, page_size=page_size)
@@ -0,0 +1,130 @@
+"""
+Denormalized product rating aggregates.
+
+Product.rating_sum / rating_count / rating_avg cover approved Reviews and all
+ProductComments, the star ratings customers leave on the product page. They
+are adjusted incrementally by signals (see signals.py) and can be recomputed
+from scratch with `manage.py reconcile_ratings`. rating_avg is rounded half
+up to two places both ways.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Case, Count, DecimalField, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast, Floor, Now
+from django.utils import timezone
+
+from .models import Product, ProductComment, Review
+
+CENT = Decimal('0.01')
+
+
+def rating_contribution(instance):
+    """Return (product_id, rating sum, rating count) a review or comment adds to its product"""
+    if isinstance(instance, Review) and not instance.is_approved:
+        return instance.product_id, 0, 0
+    return instance.product_id, instance.rating, 1
+
+
+def average(rating_sum, rating_count):
+    """rating_avg for the given totals"""
+    if not rating_count:
+        return Decimal(0)
+    return (Decimal(rating_sum) / rating_count).quantize(CENT, ROUND_HALF_UP)
+
+
+def apply_rating_delta(product_id, sum_delta, count_delta):
+    """Shift a product's rating aggregates by the given deltas in a single UPDATE"""
+    if not (sum_delta or count_delta):
+        return
+    new_sum = F('rating_sum') + sum_delta
+    new_count = F('rating_count') + count_delta
+    Product.objects.filter(pk=product_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        # Every right-hand side sees the pre-update row, so this reads as
+        # "new count > 0" and the average is computed from the new totals.
+        # Rounded half up in hundredths like average(): an exact half such as
+        # 267.5 survives the float division, so floor(x + 0.5) rounds it up.
+        rating_avg=Case(
+            When(
+                rating_count__gt=-count_delta,
+                then=Floor(Cast(new_sum, FloatField()) * 100 / new_count + 0.5) / 100,
+            ),
+            default=Value(0),
+            output_field=DecimalField(max_digits=3, decimal_places=2),
+        ),
+        updated_at=Now(),
+    )
+
+
+def snapshot_rating(instance):
+    """Remember what a saved review or comment contributed before it is changed"""
+    sender = type(instance)
+    previous = None
+    if instance.pk is not None:
+        fields = ['product_id', 'rating'] + (['is_approved'] if sender is Review else [])
+        previous = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if previous is None:
+        instance._rating_snapshot = None
+    elif not previous.get('is_approved', True):
+        instance._rating_snapshot = (previous['product_id'], 0, 0)
+    else:
+        instance._rating_snapshot = (previous['product_id'], previous['rating'], 1)
+
+
+def sync_rating(instance):
+    """Apply the difference between an instance's snapshot and its current state"""
+    product_id, new_sum, new_count = rating_contribution(instance)
+    previous = getattr(instance, '_rating_snapshot', None)
+    if previous is None:
+        apply_rating_delta(product_id, new_sum, new_count)
+        return
+    old_product_id, old_sum, old_count = previous
+    if old_product_id == product_id:
+        apply_rating_delta(product_id, new_sum - old_sum, new_count - old_count)
+    else:
+        apply_rating_delta(old_product_id, -old_sum, -old_count)
+        apply_rating_delta(product_id, new_sum, new_count)
+    instance._rating_snapshot = (product_id, new_sum, new_count)
+
+
+def compute_ratings(product_ids):
+    """Recompute {product_id: (sum, count)} from approved reviews and comments"""
+    totals = {product_id: (0, 0) for product_id in product_ids}
+    sources = [
+        Review.objects.filter(product_id__in=product_ids, is_approved=True),
+        ProductComment.objects.filter(product_id__in=product_ids),
+    ]
+    for queryset in sources:
+        rows = queryset.values('product_id').annotate(total=Sum('rating'), count=Count('id')).order_by()
+        for row in rows:
+            rating_sum, rating_count = totals[row['product_id']]
+            totals[row['product_id']] = (rating_sum + row['total'], rating_count + row['count'])
+    return totals
+
+
+def reconcile_ratings(batch_size=1000):
+    """Rewrite every drifted product rating aggregate, return the number fixed"""
+    fixed = 0
+    last_pk = 0
+    while True:
+        products = list(
+            Product.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'rating_sum', 'rating_count', 'rating_avg')[:batch_size]
+        )
+        if not products:
+            return fixed
+        last_pk = products[-1].pk
+        totals = compute_ratings([product.pk for product in products])
+        changed = []
+        for product in products:
+            rating_sum, rating_count = totals[product.pk]
+            rating_avg = average(rating_sum, rating_count)
+            if (product.rating_sum, product.rating_count, product.rating_avg) != (rating_sum, rating_count, rating_avg):
+                product.rating_sum = rating_sum
+                product.rating_count = rating_count
+                product.rating_avg = rating_avg
+                product.updated_at = timezone.now()
+                changed.append(product)
+        Product.objects.bulk_update(changed, ['rating_sum', 'rating_count', 'rating_avg', 'updated_at'])
+        fixed += len(changed)
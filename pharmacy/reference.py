@@ -0,0 +1,130 @@
+"""
+Reference data shared by the listing views.
+
+Categories, specializations, active payment methods and per-category product
+counts are small and rarely change, so each process keeps them in memory.
+Entries are tagged with the "reference" cache generation; model signals bump
+that generation (see signals.py), which makes every process sharing the cache
+reload on its next access. That needs a cache shared by all processes
+(settings_production.py insists on one). As a backstop for changes no signal
+sees, such as queryset.update(), entries are also reloaded once they are
+LOCAL_TTL seconds old.
+
+The a-prefixed functions are the same lookups for async views: they share
+the in-process entries and load missing ones with the async ORM.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count
+
+from . import caching
+from .models import Category, PaymentMethod, Product, Specialization
+
+REFERENCE = 'reference'
+
+LOCAL_TTL = getattr(settings, 'PHARMACY_REFERENCE_TTL', 60)  # seconds
+
+_local = {}
+_lock = threading.Lock()
+
+
+def _fresh(entry, version):
+    return entry is not None and entry[0] == version and time.monotonic() - entry[1] < LOCAL_TTL
+
+
+def _get(name, producer):
+    version = caching.generation(REFERENCE)
+    entry = _local.get(name)
+    if _fresh(entry, version):
+        return entry[2]
+    value = producer()
+    with _lock:
+        _local[name] = (version, time.monotonic(), value)
+    return value
+
+
+async def _aget(name, producer):
+    version = await caching.ageneration(REFERENCE)
+    entry = _local.get(name)
+    if _fresh(entry, version):
+        return entry[2]
+    value = await producer()
+    with _lock:
+        _local[name] = (version, time.monotonic(), value)
+    return value
+
+
+def invalidate():
+    caching.invalidate(REFERENCE)
+
+
+def _product_counts():
+    return Product.objects.filter(is_active=True).values_list('category_id').annotate(count=Count('id')).order_by()
+
+
+def _specializations():
+    # doctor_count saves the doctors page a COUNT per specialization
+    return Specialization.objects.annotate(doctor_count=Count('doctor')).order_by('pk')
+
+
+def _with_product_counts(items, counts):
+    for category in items:
+        category.product_count = counts.get(category.pk, 0)
+    return items
+
+
+def category_product_counts():
+    """{category_id: number of active products}"""
+    return _get('category_product_counts', lambda: dict(_product_counts()))
+
+
+async def acategory_product_counts():
+    async def load():
+        return {category_id: count async for category_id, count in _product_counts()}
+    return await _aget('category_product_counts', load)
+
+
+def categories():
+    """All categories, each annotated with product_count"""
+    def load():
+        return _with_product_counts(list(Category.objects.order_by('pk')), category_product_counts())
+    return _get('categories', load)
+
+
+async def acategories():
+    async def load():
+        items = [category async for category in Category.objects.order_by('pk')]
+        return _with_product_counts(items, await acategory_product_counts())
+    return await _aget('categories', load)
+
+
+def total_product_count():
+    return sum(category_product_counts().values())
+
+
+async def atotal_product_count():
+    return sum((await acategory_product_counts()).values())
+
+
+def specializations():
+    """All specializations, each annotated with doctor_count"""
+    return _get('specializations', lambda: list(_specializations()))
+
+
+async def aspecializations():
+    return await _aget('specializations', lambda: _alist(_specializations()))
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+def payment_methods():
+    return _get('payment_methods', lambda: list(PaymentMethod.objects.filter(is_active=True).order_by('pk')))
+
+
+def payment_method(method_id):
+    """Active payment method with the given id, or None"""
+    return next((method for method in payment_methods() if str(method.pk) == str(method_id)), None)
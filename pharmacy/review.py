@@ -0,0 +1,97 @@
+"""
+Pharmacist prescription review queue.
+
+Pending prescriptions are worked urgent first, then oldest first (the order of
+prescription_queue_idx). A pharmacist claims a batch; rows are locked with
+SELECT ... FOR UPDATE SKIP LOCKED while claiming, so pharmacists working the
+queue at the same time each get different prescriptions. Claims expire after
+CLAIM_TTL so that an abandoned batch returns to the queue. Approving or
+rejecting a selection is one UPDATE.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Prescription
+from .tasks import notify_users
+
+QUEUE_ORDER = ('-is_urgent', 'uploaded_at', 'pk')
+BATCH_SIZE = getattr(settings, 'PHARMACY_REVIEW_BATCH_SIZE', 20)
+CLAIM_TTL = getattr(settings, 'PHARMACY_REVIEW_CLAIM_TTL', 15 * 60)  # seconds
+
+DECISIONS = ('approved', 'rejected')
+
+
+def pending():
+    return Prescription.objects.filter(status='pending').order_by(*QUEUE_ORDER)
+
+
+def queue_counts():
+    """{'pending': ..., 'urgent': ...} in one query"""
+    return Prescription.objects.filter(status='pending').aggregate(
+        pending=Count('pk'), urgent=Count('pk', filter=Q(is_urgent=True)),
+    )
+
+
+def _claimable(user):
+    expired = timezone.now() - timedelta(seconds=CLAIM_TTL)
+    return pending().filter(Q(claimed_by__isnull=True) | Q(claimed_at__lt=expired) | Q(claimed_by=user))
+
+
+def claim_batch(user, size=BATCH_SIZE):
+    """Claim (or keep) up to size prescriptions for user and return them in queue order"""
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = _claimable(user)
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:size])
+        # Conditional, so a row claimed by someone else in the meantime is left alone
+        _claimable(user).filter(pk__in=ids).update(claimed_by=user, claimed_at=now)
+    return list(
+        pending().filter(claimed_by=user).select_related('doctor', 'user')[:size]
+    )
+
+
+def release(user, ids=None):
+    """Hand claimed prescriptions back to the queue"""
+    claimed = Prescription.objects.filter(claimed_by=user, status='pending')
+    if ids is not None:
+        claimed = claimed.filter(pk__in=ids)
+    return claimed.update(claimed_by=None, claimed_at=None)
+
+
+def decide(user, ids, status, notes='', claimed_only=True):
+    """
+    Approve or reject prescriptions with a single UPDATE.
+
+    Only pending rows are touched, and with claimed_only only those claimed
+    by user, so a decision can never overwrite another pharmacist's work.
+    Returns the number of prescriptions updated.
+    """
+    if status not in DECISIONS:
+        raise ValueError(f'Unknown decision {status!r}')
+    with transaction.atomic():
+        rows = Prescription.objects.filter(pk__in=ids, status='pending')
+        if claimed_only:
+            rows = rows.filter(claimed_by=user)
+        if connection.features.has_select_for_update:
+            rows = rows.select_for_update()
+        decided = list(rows.values_list('pk', 'user_id'))
+        fields = {'status': status, 'reviewed_by': user, 'reviewed_at': timezone.now(),
+                  'claimed_by': None, 'claimed_at': None}
+        if notes:
+            fields['notes'] = notes
+        updated = Prescription.objects.filter(pk__in=[pk for pk, _ in decided]).update(**fields)
+        metrics.adjust(metrics.PENDING_PRESCRIPTIONS, -updated)
+        label = dict(Prescription.STATUS_CHOICES)[status].lower()
+        notify_users(
+            sorted({user_id for _, user_id in decided}), f'Prescription {label}',
+            f'Your prescription has been {label}.' + (f' Note from the pharmacist: {notes}' if notes else ''),
+            'prescription',
+        )
+    return updated
@@ -0,0 +1,236 @@
+"""
+Full-text product search.
+
+Products are indexed into a database-native inverted index (SQLite FTS5 or a
+PostgreSQL tsvector column with a GIN index) so that searches never fall back
+to leading-wildcard LIKE scans over the product table. The backend is picked
+from the database vendor, or from the PHARMACY_SEARCH_BACKEND setting.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+# Columns of Product that are searchable, with their relative weights
+SEARCH_FIELDS = ('name', 'brand', 'manufacturer', 'ingredients', 'uses', 'description')
+FIELD_WEIGHTS = {
+    'name': 10.0,
+    'brand': 5.0,
+    'manufacturer': 3.0,
+    'ingredients': 4.0,
+    'uses': 2.0,
+    'description': 1.0,
+}
+
+FTS_TABLE = 'pharmacy_product_fts'
+PRODUCT_TABLE = 'pharmacy_product'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search string into lowercase word tokens"""
+    return [token.lower() for token in _TOKEN_RE.findall(query or '')]
+
+
+class BaseSearchBackend:
+    """Interface every search backend implements"""
+
+    def match(self, query):
+        """
+        Return (condition, rank) for query, or None if it has no search terms.
+
+        condition is a Q restricting products to the matches and rank an
+        expression that is lower for better matches. Both stay in SQL, so
+        every match survives whatever filters the caller adds afterwards.
+        """
+        raise NotImplementedError
+
+    def index_products(self, products):
+        """Add or refresh the index entries of the given products"""
+        raise NotImplementedError
+
+    def remove_products(self, product_ids):
+        """Drop the index entries of the given product ids"""
+        raise NotImplementedError
+
+    def rebuild(self, batch_size=1000):
+        """Rebuild the whole index from the product table, return rows indexed"""
+        raise NotImplementedError
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Fallback for databases without a native full-text index"""
+
+    def match(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        condition = Q()
+        for token in tokens:
+            token_q = Q()
+            for field in SEARCH_FIELDS:
+                token_q |= Q(**{f'{field}__icontains': token})
+            condition &= token_q
+        return condition, Value(0.0)
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 virtual table keyed by the product id (rowid)"""
+
+    def _match_expression(self, query):
+        # Quote every token so user input can never be parsed as FTS syntax,
+        # and allow prefix matches so "parac" finds "paracetamol".
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def match(self, query):
+        expression = self._match_expression(query)
+        if not expression:
+            return None
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in SEARCH_FIELDS)
+        condition = Q(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression],
+        ))
+        # bm25() is negative and lower for better matches. LIMIT -1 keeps
+        # SQLite from flattening the ranked matches into the correlated
+        # lookup, so they are computed once and probed through an automatic
+        # index instead of re-running the MATCH for every product.
+        rank = RawSQL(
+            f'SELECT match_rank FROM (SELECT rowid AS match_id, bm25({FTS_TABLE}, {weights}) AS match_rank '
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT -1) WHERE match_id = {PRODUCT_TABLE}.id',
+            [expression], output_field=FloatField(),
+        )
+        return condition, rank
+
+    def index_products(self, products):
+        rows = [
+            [product.pk] + [getattr(product, field) or '' for field in SEARCH_FIELDS]
+            for product in products
+        ]
+        if not rows:
+            return
+        self.remove_products([row[0] for row in rows])
+        self._insert_rows(rows)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [[product_id] for product_id in product_ids],
+            )
+
+    def _insert_rows(self, rows):
+        columns = ', '.join(SEARCH_FIELDS)
+        placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES ({placeholders})',
+                rows,
+            )
+
+    def rebuild(self, batch_size=1000):
+        from .models import Product
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        total = 0
+        batch = []
+        queryset = Product.objects.order_by('pk').values_list('pk', *SEARCH_FIELDS)
+        for row in queryset.iterator(chunk_size=batch_size):
+            batch.append([value or '' for value in row])
+            if len(batch) >= batch_size:
+                self._insert_rows(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self._insert_rows(batch)
+            total += len(batch)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        return total
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Stored, generated tsvector column on pharmacy_product with a GIN index.
+
+    PostgreSQL keeps the generated column up to date on every INSERT/UPDATE,
+    so there is nothing to do on save or delete.
+    """
+
+    def match(self, query):
+        if not tokenize(query):
+            return None
+        condition = Q(pk__in=RawSQL(
+            f"SELECT id FROM {PRODUCT_TABLE} WHERE search_vector @@ websearch_to_tsquery('english', %s)",
+            [query],
+        ))
+        rank = RawSQL(
+            f"-ts_rank({PRODUCT_TABLE}.search_vector, websearch_to_tsquery('english', %s))",
+            [query], output_field=FloatField(),
+        )
+        return condition, rank
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        from .models import Product
+        with connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX pharmacy_product_search_gin')
+        return Product.objects.count()
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured search backend, chosen once per process"""
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'PHARMACY_SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        elif connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            _backend = SQLiteFTSBackend()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = BasicSearchBackend()
+    return _backend
+
+
+def search_products(query, queryset=None):
+    """
+    Filter queryset down to products matching query, ordered by relevance.
+
+    Products match on the full-text index or on their category's name. The
+    queryset is annotated with `search_rank` (lower is better), so callers
+    can still apply their own filters and keep the ranking.
+    """
+    from .models import Category, Product
+    if queryset is None:
+        queryset = Product.objects.all()
+    matched = get_backend().match(query)
+    if matched is None:
+        return queryset.none()
+    condition, rank = matched
+    categories = Category.objects.filter(name__icontains=query.strip()).values('pk')
+    return queryset.filter(condition | Q(category_id__in=categories)).annotate(
+        search_rank=Coalesce(rank, Value(0.0)),
+    ).order_by('search_rank')
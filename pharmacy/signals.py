@@ -0,0 +1,245 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, coupons, images, inventory, metrics, monitoring, reference
+from .cartstore import cart_namespace
+from .models import (
+    Banner, CartLine, Category, Coupon, Doctor, Order, PaymentMethod, Prescription, Product, ProductComment,
+    ProductImage, Review, Specialization, StockBatch,
+)
+from .ratings import apply_rating_delta, rating_contribution, snapshot_rating, sync_rating
+from .search import get_backend
+from .taskqueue import enqueue
+from .tasks import generate_image_derivatives
+
+
+# Keep the full-text search index in sync with the product table
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_backend().index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_backend().remove_products([instance.pk])
+
+
+# Keep Product.rating_sum / rating_count / rating_avg in step with reviews and comments
+@receiver(pre_save, sender=Review)
+@receiver(pre_save, sender=ProductComment)
+def remember_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    snapshot_rating(instance)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=ProductComment)
+def update_product_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    sync_rating(instance)
+
+
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=ProductComment)
+def remove_product_rating(sender, instance, **kwargs):
+    product_id, rating_sum, rating_count = rating_contribution(instance)
+    apply_rating_delta(product_id, -rating_sum, -rating_count)
+
+
+# Drop cached home page data whenever what it shows changes
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def invalidate_home_cache(sender, **kwargs):
+    caching.invalidate(caching.HOME)
+
+
+# Doctor listings (API ETags) change with doctors and their specializations
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Specialization)
+@receiver(post_delete, sender=Specialization)
+def invalidate_doctors_cache(sender, **kwargs):
+    caching.invalidate(caching.DOCTORS)
+
+
+# Reload the in-process reference data (categories, counts, ...) everywhere
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Specialization)
+@receiver(post_delete, sender=Specialization)
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_delete, sender=PaymentMethod)
+def invalidate_reference_data(sender, **kwargs):
+    reference.invalidate()
+
+
+# Cached coupon lookups (coupons.lookup) change with the coupon and its scope
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_coupon(sender, instance, **kwargs):
+    coupons.forget(instance.code)
+
+
+@receiver(m2m_changed, sender=Coupon.categories.through)
+@receiver(m2m_changed, sender=Coupon.products.through)
+def invalidate_coupon_scope(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        coupons.forget(instance.code)
+    else:
+        # Changed from the category's or product's side
+        for code in Coupon.objects.filter(pk__in=pk_set or ()).values_list('code', flat=True):
+            coupons.forget(code)
+
+
+# Cart summaries go stale when lines change outside the CartStore, e.g. when
+# deleting a product or user cascades to them
+@receiver(post_save, sender=CartLine)
+@receiver(post_delete, sender=CartLine)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    caching.invalidate(cart_namespace(instance.user_id))
+
+
+# Resized WebP/AVIF copies of uploaded images for the responsive_image tag
+IMAGE_FIELDS = {Product: 'image', ProductImage: 'image', Doctor: 'photo', Banner: 'photo'}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Banner)
+def queue_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    field = IMAGE_FIELDS[sender]
+    fieldfile = getattr(instance, field)
+    if fieldfile and not images.has_derivatives(fieldfile.name, fieldfile.storage):
+        enqueue(generate_image_derivatives, {'model': sender._meta.label, 'pk': instance.pk, 'field': field})
+
+
+# ... which go away with the image they were made from, once no row uses it
+DERIVATIVE_FIELDS = {**IMAGE_FIELDS, Prescription: 'image'}
+
+
+def drop_derivatives(sender, name, storage):
+    if name and not sender.objects.filter(**{DERIVATIVE_FIELDS[sender]: name}).exists():
+        images.delete_derivatives(name, storage)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+@receiver(pre_save, sender=Doctor)
+@receiver(pre_save, sender=Banner)
+@receiver(pre_save, sender=Prescription)
+def remember_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    field = DERIVATIVE_FIELDS[sender]
+    instance._previous_image = None
+    if raw or instance.pk is None or (update_fields is not None and field not in update_fields):
+        return
+    instance._previous_image = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Banner)
+@receiver(post_save, sender=Prescription)
+def drop_replaced_image_derivatives(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_image', None)
+    fieldfile = getattr(instance, DERIVATIVE_FIELDS[sender])
+    if raw or not previous or previous == fieldfile.name:
+        return
+    storage = fieldfile.storage
+    transaction.on_commit(lambda: drop_derivatives(sender, previous, storage))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Banner)
+@receiver(post_delete, sender=Prescription)
+def drop_deleted_image_derivatives(sender, instance, **kwargs):
+    fieldfile = getattr(instance, DERIVATIVE_FIELDS[sender])
+    if fieldfile:
+        name, storage = fieldfile.name, fieldfile.storage
+        transaction.on_commit(lambda: drop_derivatives(sender, name, storage))
+
+
+# Keep the admin dashboard counters current
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Order)
+@receiver(pre_save, sender=Prescription)
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=User)
+def snapshot_metrics(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    metrics.snapshot(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Prescription)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=User)
+def update_metrics(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    metrics.track_save(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Prescription)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=User)
+def remove_from_metrics(sender, instance, **kwargs):
+    metrics.track_delete(instance)
+
+
+# Raise or resolve low-stock and expiry alerts when a product is edited
+@receiver(post_save, sender=Product)
+def check_stock_alerts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    monitoring.notify(monitoring.evaluate([instance]))
+
+
+# Product.stock is the sum of its batches: stock given to a new product opens its first batch
+@receiver(post_save, sender=Product)
+def open_stock_batch(sender, instance, created, raw=False, **kwargs):
+    if raw or not created or not instance.stock:
+        return
+    # bulk_create skips refresh_stock: the new product's columns already are the aggregate
+    StockBatch.objects.bulk_create([StockBatch(
+        product=instance, batch_number=instance.batch_number or inventory.OPENING_BATCH,
+        expiry_date=instance.expiry_date, quantity=instance.stock,
+    )])
+
+
+@receiver(post_save, sender=StockBatch)
+def refresh_stock(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    inventory.refresh_products([instance.product_id])
+
+
+@receiver(post_delete, sender=StockBatch)
+def refresh_stock_after_delete(sender, instance, **kwargs):
+    # After commit, so deleting a whole product does not first rewrite its stock
+    transaction.on_commit(lambda: inventory.refresh_products([instance.product_id]))
@@ -0,0 +1,161 @@
+"""
+Bulk price and stock updates pushed by the ERP.
+
+The ERP sends thousands of rows at a time, each naming a product by its slug
+(`slug`, or `sku` as an alias) and carrying any of `price`, `mrp` and
+`stock`. Stock is the absolute quantity of one batch: `batch_number`
+(default: the opening batch) with an optional `expiry_date`, the same
+convention the catalog import uses.
+
+apply_updates() validates every row, then writes all of them in one
+transaction: products are fetched and written in chunks with in_bulk() and
+bulk_update(), stock batches are upserted with bulk_create(update_conflicts)
+and the stock aggregate is refreshed per chunk. bulk_update bypasses model
+signals, so the home page cache is invalidated once, after commit. Each row
+gets a result: updated, unchanged, not_found or invalid (with errors).
+
+The HTTP endpoint authenticates the ERP with a bearer key from the
+PHARMACY_ERP_API_KEYS setting rather than a session.
+"""
+import hmac
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, inventory
+from .models import Product, StockBatch
+
+CHUNK_SIZE = 500
+MAX_ROWS = 10000  # per HTTP request
+
+PRICE_FIELDS = ('price', 'mrp')
+
+
+def authorized(request):
+    """Does the request carry one of the configured ERP API keys?"""
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not key:
+        return False
+    keys = getattr(settings, 'PHARMACY_ERP_API_KEYS', [])
+    return any(hmac.compare_digest(key.encode(), valid.encode()) for valid in keys)
+
+
+def _clean(model, name, value):
+    try:
+        return model._meta.get_field(name).clean(value, None)
+    except ValidationError as exc:
+        raise ValidationError(f'{name}: {" ".join(exc.messages)}') from None
+    except (TypeError, ValueError):
+        # e.g. a date sent as a number, which the field's parser does not expect
+        raise ValidationError(f'{name}: Enter a valid value.') from None
+
+
+def _clean_price(name, value):
+    price = _clean(Product, name, value)
+    if price < 0:
+        raise ValidationError(f'{name}: must not be negative')
+    return price
+
+
+def clean_row(row):
+    """Return (slug, {field: value}), raising ValidationError"""
+    if not isinstance(row, dict):
+        raise ValidationError('expected an object')
+    slug = row.get('slug') or row.get('sku')
+    if not slug or not isinstance(slug, str):
+        raise ValidationError('slug: This field is required.')
+    changes = {name: _clean_price(name, row[name]) for name in PRICE_FIELDS if row.get(name) is not None}
+    if row.get('stock') is not None:
+        changes['stock'] = _clean(StockBatch, 'quantity', row['stock'])
+        batch_number = str(row.get('batch_number') or '').strip() or inventory.OPENING_BATCH
+        changes['batch_number'] = _clean(StockBatch, 'batch_number', batch_number)
+        if row.get('expiry_date'):
+            changes['expiry_date'] = _clean(StockBatch, 'expiry_date', row['expiry_date'])
+    if not changes:
+        raise ValidationError('nothing to update: send price, mrp or stock')
+    return slug, changes
+
+
+def _apply_chunk(rows, results, now):
+    """rows are [(index, slug, changes)] of valid rows"""
+    products = Product.objects.in_bulk({slug for _, slug, _ in rows}, field_name='slug')
+    batches = {
+        (batch.product_id, batch.batch_number): batch
+        for batch in StockBatch.objects.filter(
+            product__in=[product.pk for product in products.values()],
+            batch_number__in={changes['batch_number'] for _, _, changes in rows if 'stock' in changes},
+        )
+    }
+    changed_products = {}
+    changed_batches = {}
+    for index, slug, changes in rows:
+        product = products.get(slug)
+        if product is None:
+            results[index] = {'slug': slug, 'status': 'not_found'}
+            continue
+        prices = {name: changes.get(name, getattr(product, name)) for name in PRICE_FIELDS}
+        if prices['price'] > prices['mrp']:
+            results[index] = {'slug': slug, 'status': 'invalid', 'errors': ['price: must not exceed the MRP']}
+            continue
+
+        updated = False
+        if any(getattr(product, name) != value for name, value in prices.items()):
+            product.price, product.mrp, product.updated_at = prices['price'], prices['mrp'], now
+            changed_products[product.pk] = product
+            updated = True
+        if 'stock' in changes:
+            key = (product.pk, changes['batch_number'])
+            batch = batches.get(key)
+            if batch is None:
+                batch = batches[key] = StockBatch(product=product, batch_number=changes['batch_number'])
+            expiry_date = changes.get('expiry_date', batch.expiry_date)
+            if batch.pk is None or (batch.quantity, batch.expiry_date) != (changes['stock'], expiry_date):
+                batch.quantity, batch.expiry_date = changes['stock'], expiry_date
+                changed_batches[key] = batch
+                updated = True
+        results[index] = {'slug': slug, 'status': 'updated' if updated else 'unchanged'}
+
+    Product.objects.bulk_update(changed_products.values(), [*PRICE_FIELDS, 'updated_at'], batch_size=CHUNK_SIZE)
+    StockBatch.objects.bulk_create(
+        changed_batches.values(), update_conflicts=True, unique_fields=['product', 'batch_number'],
+        update_fields=['quantity', 'expiry_date'],
+    )
+    inventory.refresh_products({product_id for product_id, _ in changed_batches})
+    return bool(changed_products or changed_batches)
+
+
+def apply_updates(rows):
+    """
+    Apply ERP rows in one transaction, return one result dict per row.
+
+    Invalid rows are reported and skipped; they never roll back the others.
+    """
+    results = [None] * len(rows)
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            slug, changes = clean_row(row)
+        except ValidationError as exc:
+            slug = (row.get('slug') or row.get('sku')) if isinstance(row, dict) else None
+            results[index] = {'slug': slug, 'status': 'invalid', 'errors': exc.messages}
+            continue
+        valid.append((index, slug, changes))
+
+    now = timezone.now()
+    with transaction.atomic():
+        changed = False
+        for start in range(0, len(valid), CHUNK_SIZE):
+            changed |= _apply_chunk(valid[start:start + CHUNK_SIZE], results, now)
+        if changed:
+            transaction.on_commit(lambda: caching.invalidate(caching.HOME))
+    return results
+
+
+def summarize(results):
+    """{status: number of rows}"""
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return summary
@@ -0,0 +1,206 @@
+"""
+Database-backed background task queue.
+
+Request handlers call `enqueue(some_task, {...})` and return straight away;
+`manage.py run_worker` claims due tasks, highest priority first, and runs them
+on a thread pool. Failed tasks are retried with exponential backoff until
+max_attempts is reached. The Task table is the queue, so no broker is needed,
+and several workers can run side by side: claiming uses SELECT ... FOR UPDATE
+SKIP LOCKED where the database has it, plus a conditional UPDATE everywhere.
+
+A claim is a lease: the worker renews locked_at of the tasks it is running
+every HEARTBEAT_INTERVAL, and only tasks whose lease has not been renewed for
+STALE_AFTER (their worker died) are handed back to the queue, so a slow task
+is never run twice at once.
+
+Handlers are registered with the @task decorator (see tasks.py) and receive
+the payload as keyword arguments, so payloads must be JSON serializable.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+LOW = -10
+NORMAL = 0
+HIGH = 10
+
+RETRY_DELAY = getattr(settings, 'PHARMACY_TASK_RETRY_DELAY', 30)  # seconds, doubled per attempt
+STALE_AFTER = getattr(settings, 'PHARMACY_TASK_STALE_AFTER', 600)  # seconds without a heartbeat
+HEARTBEAT_INTERVAL = STALE_AFTER / 10  # seconds
+# Run tasks in-process right after the enqueuing transaction commits (development)
+EAGER = getattr(settings, 'PHARMACY_TASKS_EAGER', False)
+
+_registry = {}
+
+
+def task(name=None, priority=NORMAL, max_attempts=3):
+    """Register a function as a background task"""
+    def decorator(func):
+        func.task_name = name or f'{func.__module__}.{func.__name__}'
+        func.priority = priority
+        func.max_attempts = max_attempts
+        _registry[func.task_name] = func
+        return func
+    return decorator
+
+
+def enqueue(func, payload=None, priority=None, delay=0):
+    """Queue func(**payload); joins the caller's transaction if there is one"""
+    queued = Task.objects.create(
+        name=func.task_name,
+        payload=payload or {},
+        priority=func.priority if priority is None else priority,
+        max_attempts=func.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if EAGER:
+        transaction.on_commit(lambda: run_claimed(claim('eager', pk=queued.pk)))
+    return queued
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker, limit=1, pk=None):
+    """Mark up to limit due tasks as running for this worker and return them"""
+    now = timezone.now()
+    with transaction.atomic():
+        due = Task.objects.filter(status='queued', run_at__lte=now)
+        if pk is not None:
+            due = due.filter(pk=pk)
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.order_by('-priority', 'run_at', 'id').values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        token = f'{worker}:{uuid.uuid4().hex[:8]}'
+        # Conditional so that two workers racing for the same row cannot both win
+        Task.objects.filter(pk__in=ids, status='queued').update(
+            status='running', locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+        )
+        return list(Task.objects.filter(locked_by=token, status='running').order_by('-priority', 'run_at', 'id'))
+
+
+def execute(claimed):
+    """Run one claimed task and record the outcome, return True on success"""
+    func = _registry.get(claimed.name)
+    try:
+        if func is None:
+            raise LookupError(f'No task registered as {claimed.name!r}')
+        func(**claimed.payload)
+    except Exception:
+        logger.exception('Task %s failed (attempt %s of %s)', claimed, claimed.attempts, claimed.max_attempts)
+        error = traceback.format_exc()
+        now = timezone.now()
+        if claimed.attempts < claimed.max_attempts:
+            backoff = RETRY_DELAY * 2 ** (claimed.attempts - 1)
+            Task.objects.filter(pk=claimed.pk).update(
+                status='queued', locked_by='', locked_at=None, last_error=error,
+                run_at=now + timedelta(seconds=backoff),
+            )
+        else:
+            Task.objects.filter(pk=claimed.pk).update(status='failed', last_error=error, finished_at=now)
+        return False
+    Task.objects.filter(pk=claimed.pk).update(status='done', finished_at=timezone.now())
+    return True
+
+
+def run_claimed(tasks):
+    for claimed in tasks:
+        execute(claimed)
+
+
+def renew(tasks):
+    """Extend the lease on claimed tasks that are still running"""
+    if not tasks:
+        return 0
+    return Task.objects.filter(
+        pk__in=[claimed.pk for claimed in tasks], locked_by__in={claimed.locked_by for claimed in tasks},
+        status='running',
+    ).update(locked_at=timezone.now())
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Give tasks whose worker died mid-run back to the queue (or fail them)"""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    stale = Task.objects.filter(status='running', locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', last_error='Worker stopped responding', finished_at=timezone.now(),
+    )
+    requeued = stale.update(status='queued', locked_by='', locked_at=None)
+    return requeued + failed
+
+
+def purge_finished(days=7):
+    """Delete done tasks older than days, return the number deleted"""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = Task.objects.filter(status='done', finished_at__lt=cutoff).delete()
+    return deleted
+
+
+class Worker:
+    """Polls the queue and runs tasks on a pool of threads"""
+
+    def __init__(self, threads=4, poll_interval=1.0, name=None):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = name or worker_name()
+        self.stopping = threading.Event()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def _run(self, claimed):
+        try:
+            return execute(claimed)
+        finally:
+            close_old_connections()
+
+    def run(self, burst=False):
+        """Work until stop() is called, or until the queue is empty if burst"""
+        processed = 0
+        running = {}
+        last_sweep = last_heartbeat = None
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='pharmacy-worker') as pool:
+            while not self.stopping.is_set():
+                now = timezone.now()
+                if last_sweep is None or (now - last_sweep).total_seconds() > 60:
+                    requeue_stale()
+                    last_sweep = now
+                if last_heartbeat is None or (now - last_heartbeat).total_seconds() > HEARTBEAT_INTERVAL:
+                    renew(list(running.values()))
+                    last_heartbeat = now
+
+                free = self.threads - len(running)
+                claimed = claim(self.name, limit=free) if free else []
+                for item in claimed:
+                    running[pool.submit(self._run, item)] = item
+
+                if running:
+                    done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del running[future]
+                    processed += len(done)
+                elif burst:
+                    break
+                else:
+                    close_old_connections()
+                    self.stopping.wait(self.poll_interval)
+            # Let in-flight tasks finish before exiting
+            processed += len(wait(running).done)
+        return processed
@@ -0,0 +1,91 @@
+"""
+Background tasks run by `manage.py run_worker` (see taskqueue.py).
+"""
+from django.apps import apps
+from django.contrib.auth.models import User
+from PIL import UnidentifiedImageError
+
+from . import images, metrics, monitoring, uploads
+from .models import Notification, Prescription
+from .taskqueue import HIGH, LOW, NORMAL, enqueue, task
+
+NOTIFICATION_BATCH_SIZE = 500
+
+
+@task(priority=NORMAL)
+def process_prescription(prescription_id):
+    """Validate an uploaded prescription, strip its metadata and tell the pharmacists"""
+    prescription = Prescription.objects.filter(pk=prescription_id).first()
+    if prescription is None or not prescription.image:
+        return
+    try:
+        name = images.sanitize(prescription.image)
+    except UnidentifiedImageError:
+        rejected = Prescription.objects.filter(pk=prescription.pk, status='pending').update(
+            status='rejected', notes='Uploaded file is not a readable image',
+        )
+        metrics.adjust(metrics.PENDING_PRESCRIPTIONS, -rejected)
+        notify_users([prescription.user_id], 'Prescription could not be read',
+                     'Please upload a clear photo or scan of your prescription.', 'prescription')
+        return
+    if name != prescription.image.name:
+        original = prescription.image.name
+        Prescription.objects.filter(pk=prescription.pk).update(image=name)
+        prescription.image.name = name
+        # The original still carries the metadata
+        uploads.delete_if_unused(original)
+    images.generate_derivatives(prescription.image)
+
+    urgency = 'Urgent prescription' if prescription.is_urgent else 'New prescription'
+    enqueue(notify_staff, {
+        'title': f'{urgency} from {prescription.patient_name}',
+        'message': f'Dr. {prescription.doctor_name}. Awaiting review.',
+        'notification_type': 'prescription',
+        'action_url': f'/admin/pharmacy/prescription/{prescription.pk}/change/',
+    }, priority=HIGH if prescription.is_urgent else NORMAL)
+
+
+def _create_notifications(user_ids, title, message, notification_type, action_url=''):
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), NOTIFICATION_BATCH_SIZE):
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, title=title, message=message,
+                         notification_type=notification_type, action_url=action_url)
+            for user_id in user_ids[start:start + NOTIFICATION_BATCH_SIZE]
+        ])
+    return len(user_ids)
+
+
+@task(priority=NORMAL)
+def send_notifications(user_ids, title, message, notification_type, action_url=''):
+    return _create_notifications(user_ids, title, message, notification_type, action_url)
+
+
+@task(priority=NORMAL)
+def notify_staff(title, message, notification_type, action_url=''):
+    staff = User.objects.filter(is_staff=True, is_active=True).values_list('pk', flat=True).iterator()
+    return _create_notifications(staff, title, message, notification_type, action_url)
+
+
+def notify_users(user_ids, title, message, notification_type, action_url='', priority=None):
+    """Queue one Notification per user"""
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if user_ids:
+        enqueue(send_notifications, {
+            'user_ids': user_ids, 'title': title, 'message': message,
+            'notification_type': notification_type, 'action_url': action_url,
+        }, priority=priority)
+
+
+@task(priority=LOW)
+def generate_image_derivatives(model, pk, field):
+    """Resize an uploaded image for the responsive_image tag"""
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is not None:
+        images.generate_derivatives(getattr(instance, field))
+
+
+@task(priority=NORMAL)
+def check_stock(product_ids):
+    """Raise or resolve stock alerts for products whose stock changed"""
+    monitoring.check_products(product_ids)
@@ -0,0 +1,57 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from pharmacy.images import (
+    CONTENT_TYPES, WIDTHS, derivative_name, fallback_format, has_derivatives, modern_formats,
+)
+
+register = template.Library()
+
+
+def _srcset(fieldfile, fmt):
+    storage = fieldfile.storage
+    return ', '.join(
+        f'{storage.url(derivative_name(fieldfile.name, width, fmt))} {width}w' for width in WIDTHS
+    )
+
+
+@register.simple_tag
+def responsive_image(fieldfile, sizes='100vw', **attrs):
+    """
+    Render an uploaded image as a <picture> with WebP/AVIF srcsets.
+
+    Usage: {% responsive_image product.image sizes="320px" alt=product.name class="product-image" %}
+    Falls back to a plain <img> of the original until derivatives exist.
+    """
+    if not fieldfile:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if not has_derivatives(fieldfile.name, fieldfile.storage):
+        return format_html('<img src="{}"{}>', fieldfile.url, flatatt(attrs))
+
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((CONTENT_TYPES[fmt], _srcset(fieldfile, fmt), sizes) for fmt in modern_formats()),
+    )
+    fallback = fallback_format(fieldfile.name)
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        sources,
+        fieldfile.storage.url(derivative_name(fieldfile.name, WIDTHS[min(1, len(WIDTHS) - 1)], fallback)),
+        _srcset(fieldfile, fallback),
+        sizes,
+        flatatt(attrs),
+    )
+
+
+@register.filter
+def thumbnail_url(fieldfile, width=WIDTHS[0]):
+    """URL of the derivative closest to width, or the original if none exist yet"""
+    if not fieldfile:
+        return ''
+    if not has_derivatives(fieldfile.name, fieldfile.storage):
+        return fieldfile.url
+    width = min((w for w in WIDTHS if w >= int(width)), default=WIDTHS[-1])
+    return fieldfile.storage.url(derivative_name(fieldfile.name, width, fallback_format(fieldfile.name)))
@@ -0,0 +1,350 @@
+"""
+Streaming prescription uploads.
+
+Phone photos of prescriptions are large, so they never take the usual detour
+through a temporary file. PrescriptionUploadHandler writes the multipart
+stream chunk by chunk into `prescriptions/partial/`, hashing as it goes, and
+then renames the finished file to a content-addressed name in the customer's
+directory (`prescriptions/u7/ab/<sha256>.jpg`). A customer who sends the same
+photo again therefore has it stored once; different customers never share a
+file. Only signed-in customers' uploads are streamed. Size and type are checked on the first bytes, before anything large is
+written. The file is in place before the view has checked the CSRF token and
+the form, so the view deletes it again when it rejects the request.
+
+Flaky mobile connections can use the resumable protocol instead (signed-in
+customers only; tokens are bound to the customer, who can have a few open
+uploads at a time):
+
+    POST /prescriptions/uploads/          {"size": ..., "content_type": ...}
+        -> {"upload": <token>, "offset": 0}
+    GET  /prescriptions/uploads/<token>/  -> {"offset": <bytes received>}
+    POST /prescriptions/uploads/<token>/  raw bytes, Upload-Offset header
+        -> {"offset": ...} or, once complete, {"complete": true, "file": <file token>}
+
+and submit the returned file token as `prescription_upload` with the form.
+"""
+import hashlib
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+
+from .models import Prescription
+
+MAX_SIZE = getattr(settings, 'PHARMACY_PRESCRIPTION_MAX_SIZE', 20 * 1024 * 1024)  # bytes
+MAX_CHUNK_SIZE = 5 * 1024 * 1024  # per resumable request
+FORM_OVERHEAD = 64 * 1024  # the other form fields around the image
+TOKEN_MAX_AGE = 24 * 60 * 60  # seconds an unfinished or unsubmitted upload stays valid
+MAX_OPEN_UPLOADS = getattr(settings, 'PHARMACY_MAX_OPEN_UPLOADS', 3)  # unfinished resumable uploads per customer
+CHUNK_LOCK_TIMEOUT = 5 * 60  # seconds a chunk may take to arrive before its upload is unlocked
+
+UPLOAD_DIR = 'prescriptions'
+PARTIAL_DIR = f'{UPLOAD_DIR}/partial'
+ALLOWED_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp'}
+
+_UPLOAD_SALT = 'pharmacy.uploads.upload'
+_FILE_SALT = 'pharmacy.uploads.file'
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class OffsetMismatch(UploadRejected):
+    def __init__(self, offset):
+        super().__init__(f'Expected offset {offset}.')
+        self.offset = offset
+
+
+def storage():
+    return Prescription._meta.get_field('image').storage
+
+
+def is_local(target=None):
+    """Streaming needs a filesystem path to rename into place"""
+    try:
+        (target or storage()).path(UPLOAD_DIR)
+    except NotImplementedError:
+        return False
+    return True
+
+
+def sniff(head):
+    """Content type from an image's magic bytes, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def check_declared(size, content_type):
+    if content_type and content_type not in ALLOWED_TYPES:
+        raise UploadRejected('Please upload a JPG, PNG or WebP image.')
+    if size is not None and size > MAX_SIZE:
+        raise UploadRejected(f'Prescription images can be at most {MAX_SIZE // (1024 * 1024)} MB.')
+
+
+def _partial_dir(user_id=None):
+    """Streamed uploads share PARTIAL_DIR; each customer's resumable uploads get their own directory"""
+    directory = storage().path(PARTIAL_DIR if user_id is None else f'{PARTIAL_DIR}/u{user_id}')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _partial_path(upload_id, user_id=None):
+    return os.path.join(_partial_dir(user_id), f'{upload_id}.part')
+
+
+def delete_if_unused(name):
+    """Delete a stored prescription photo that no prescription refers to"""
+    if name and not Prescription.objects.filter(image=name).exists():
+        storage().delete(name)
+
+
+def _finalize(partial_path, digest, content_type, user_id):
+    """Move a finished partial file to its content-addressed name and return that name"""
+    target = storage()
+    name = f'{UPLOAD_DIR}/u{user_id}/{digest[:2]}/{digest}.{ALLOWED_TYPES[content_type]}'
+    if target.exists(name):
+        os.remove(partial_path)  # Same photo uploaded before: keep one copy
+    else:
+        path = target.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(partial_path, path)
+    return name
+
+
+class StoredUpload(UploadedFile):
+    """An upload that is already in its final place in storage"""
+
+    def __init__(self, stored_name, content_type, size):
+        name = os.path.basename(stored_name) or 'empty'
+        super().__init__(file=None, name=name, content_type=content_type, size=size)
+        self.stored_name = stored_name
+
+
+class PrescriptionUploadHandler(FileUploadHandler):
+    """Stream the prescription_image field straight into storage; other fields pass through"""
+
+    field_name = 'prescription_image'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.error = None
+        self.request_size = None
+        self.stored_name = None
+
+    def _reject(self, message):
+        self.error = message
+        self.active = False
+        if getattr(self, 'partial', None):
+            self.partial.close()
+            os.remove(self.partial.name)
+            self.partial = None
+        raise SkipFile(message)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_size = content_length
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        user = getattr(self.request, 'user', None)
+        if field_name != self.field_name or not is_local() or not (user and user.is_authenticated):
+            return
+        self.user_id = user.pk
+        self.active = True
+        self.partial = None
+        try:
+            check_declared(content_length, content_type)
+            # The whole request is only a little larger than the file
+            if self.request_size and self.request_size > MAX_SIZE + FORM_OVERHEAD:
+                check_declared(self.request_size, None)
+        except UploadRejected as exc:
+            self._reject(str(exc))
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.sniffed_type = None
+        self.partial = open(_partial_path(uuid.uuid4().hex), 'wb')
+        # No temporary file from the default handlers
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if start == 0:
+            self.sniffed_type = sniff(raw_data[:16])
+            if self.sniffed_type is None:
+                self._reject('Please upload a JPG, PNG or WebP image.')
+        self.size += len(raw_data)
+        if self.size > MAX_SIZE:
+            self._reject(f'Prescription images can be at most {MAX_SIZE // (1024 * 1024)} MB.')
+        self.digest.update(raw_data)
+        self.partial.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        self.partial.close()
+        if self.size == 0:
+            os.remove(self.partial.name)
+            return StoredUpload('', 'application/octet-stream', 0)
+        self.stored_name = _finalize(self.partial.name, self.digest.hexdigest(), self.sniffed_type, self.user_id)
+        return StoredUpload(self.stored_name, self.sniffed_type, self.size)
+
+    def upload_interrupted(self):
+        if self.active and self.partial:
+            self.partial.close()
+            os.remove(self.partial.name)
+
+
+# Resumable uploads
+
+def _open_uploads(user_id):
+    """Partial files of user_id's unexpired resumable uploads; expired ones are removed"""
+    directory = _partial_dir(user_id)
+    cutoff = time.time() - TOKEN_MAX_AGE
+    open_uploads = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.part'):
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+            else:
+                open_uploads.append(entry.path)
+    return open_uploads
+
+
+def start_upload(user, size, content_type):
+    """Begin a resumable upload for user, return its token"""
+    if not isinstance(size, int) or size <= 0:
+        raise UploadRejected('Upload size is required.')
+    check_declared(size, content_type)
+    if not is_local():
+        raise UploadRejected('Resumable uploads are not available.')
+    if len(_open_uploads(user.pk)) >= MAX_OPEN_UPLOADS:
+        raise UploadRejected(f'Finish or abandon your other uploads first (at most {MAX_OPEN_UPLOADS} at a time).')
+    upload_id = uuid.uuid4().hex
+    open(_partial_path(upload_id, user.pk), 'wb').close()
+    return signing.dumps({'id': upload_id, 'size': size, 'user': user.pk}, salt=_UPLOAD_SALT)
+
+
+def _load_upload(token, user):
+    try:
+        upload = signing.loads(token, salt=_UPLOAD_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        raise UploadRejected('Unknown or expired upload.')
+    if upload.get('user') != user.pk:
+        raise UploadRejected('Unknown or expired upload.')
+    path = _partial_path(upload['id'], user.pk)
+    if not os.path.exists(path):
+        raise UploadRejected('Unknown or expired upload.')
+    return upload, path
+
+
+def upload_offset(token, user):
+    _, path = _load_upload(token, user)
+    return os.path.getsize(path)
+
+
+def append_chunk(token, user, offset, stream, length):
+    """
+    Append length bytes from stream at offset.
+
+    Returns (offset, file_token); file_token is set once the upload is
+    complete. A mismatched offset raises OffsetMismatch so that the client
+    can resume from the offset we actually have. Chunks of one upload are
+    written one at a time: a chunk arriving while another is still being
+    written gets OffsetMismatch too.
+    """
+    upload, path = _load_upload(token, user)
+    lock = f'pharmacy:upload-lock:{upload["id"]}'
+    if not cache.add(lock, 1, CHUNK_LOCK_TIMEOUT):
+        raise OffsetMismatch(os.path.getsize(path))
+    try:
+        return _append(upload, path, offset, stream, length)
+    finally:
+        cache.delete(lock)
+
+
+def _append(upload, path, offset, stream, length):
+    current = os.path.getsize(path)
+    if offset != current:
+        raise OffsetMismatch(current)
+    if length > MAX_CHUNK_SIZE or current + length > upload['size']:
+        raise UploadRejected('Chunk is larger than the upload.')
+    with open(path, 'ab') as partial:
+        remaining = length
+        while remaining:
+            data = stream.read(min(remaining, 64 * 1024))
+            if not data:
+                break
+            if partial.tell() == 0 and sniff(data[:16]) is None:
+                partial.close()
+                os.remove(path)
+                raise UploadRejected('Please upload a JPG, PNG or WebP image.')
+            partial.write(data)
+            remaining -= len(data)
+        current = partial.tell()
+    if current < upload['size']:
+        return current, None
+
+    # Complete: one sequential read to hash it (the hasher cannot be carried across requests)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as partial:
+        head = partial.read(16)
+        digest.update(head)
+        for block in iter(lambda: partial.read(1024 * 1024), b''):
+            digest.update(block)
+    name = _finalize(path, digest.hexdigest(), sniff(head), upload['user'])
+    return current, signing.dumps({'name': name, 'user': upload['user']}, salt=_FILE_SALT)
+
+
+def stored_image(upload=None, file_token=None, user=None):
+    """
+    What to assign to Prescription.image for this request.
+
+    The storage name for streamed or resumable uploads (no further copy), or
+    the UploadedFile itself when the streaming handler was not used.
+    """
+    if isinstance(upload, StoredUpload) and upload.stored_name:
+        return upload.stored_name
+    if isinstance(upload, StoredUpload) or (upload is None and not file_token):
+        raise UploadRejected('Please attach a photo of your prescription.')
+    if file_token:
+        try:
+            stored = signing.loads(file_token, salt=_FILE_SALT, max_age=TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            stored = None
+        if not isinstance(stored, dict) or user is None or stored.get('user') != user.pk:
+            raise UploadRejected('Your upload has expired, please choose the image again.')
+        return stored['name']
+    check_declared(upload.size, upload.content_type)
+    return upload
+
+
+def purge_partial_uploads(max_age=TOKEN_MAX_AGE):
+    """Delete abandoned partial uploads, return the number removed"""
+    if not is_local():
+        return 0
+    directory = storage().path(PARTIAL_DIR)
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+    return removed
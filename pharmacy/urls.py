@@ -1,16 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, views
 
 app_name = 'pharmacy'
 
+# Read-heavy pages, native async when served over ASGI
+pages = async_views if getattr(settings, 'PHARMACY_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
-    path('', views.home, name='home'),
-    path('products/', views.product_list, name='product_list'),
-    path('product/<int:pk>/', views.product_detail, name='product_detail'),
+    path('', pages.home, name='home'),
+    path('products/', pages.product_list, name='product_list'),
+    path('product/<int:pk>/', pages.product_detail, name='product_detail'),
     path('about/', views.about, name='about'),
     path('contact/', views.contact, name='contact'),
     path('prescriptions/', views.prescriptions, name='prescriptions'),
-    path('doctors/', views.doctors, name='doctors'),
+    path('prescriptions/uploads/', views.prescription_upload_start, name='prescription_upload_start'),
+    path('prescriptions/uploads/<str:token>/', views.prescription_upload_chunk, name='prescription_upload_chunk'),
+    path('prescriptions/review/', views.review_queue, name='review_queue'),
+    path('doctors/', pages.doctors, name='doctors'),
     path('profile/', views.profile, name='profile'),
     path('auth/', views.auth_view, name='auth'),
     path('login/', views.login_view, name='login'),
@@ -21,10 +28,20 @@ urlpatterns = [
     path('decrease_cart/<int:product_id>/', views.decrease_cart, name='decrease_cart'),
     path('clear_cart/', views.clear_cart, name='clear_cart'),
     path('cart/', views.cart_view, name='cart'),
+    path('cart/items/', views.cart_json, name='cart_json'),
+    path('cart/items/<int:product_id>/', views.cart_json, name='cart_item_json'),
     path('checkout/', views.checkout, name='checkout'),
-    path('wishlist/', views.wishlist_view, name='wishlist'),
+    path('wishlist/', pages.wishlist_view, name='wishlist'),
     path('add_to_wishlist/<int:product_id>/', views.add_to_wishlist, name='add_to_wishlist'),
     path('remove_from_wishlist/<int:product_id>/', views.remove_from_wishlist, name='remove_from_wishlist'),
     path('advanced_search/', views.advanced_search, name='advanced_search'),
+    path('products/page/', views.product_page_json, name='product_page_json'),
+    path('doctors/page/', views.doctor_page_json, name='doctor_page_json'),
     path('apply_coupon/', views.apply_coupon, name='apply_coupon'),
+    path('api/erp/products/', views.erp_product_sync, name='erp_product_sync'),
+    path('api/v1/products/', api.products, name='api_products'),
+    path('api/v1/products/<int:pk>/', api.product_detail, name='api_product'),
+    path('api/v1/categories/', api.categories, name='api_categories'),
+    path('api/v1/doctors/', api.doctors, name='api_doctors'),
+    path('api/v1/banners/', api.banners, name='api_banners'),
 ]
\ No newline at end of file
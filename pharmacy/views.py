@@ -1,56 +1,70 @@
+import json
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from django.db.models import Q, Avg
-from .models import Product, Category, UserProfile, Wishlist, Coupon, PaymentMethod
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_http_methods, require_POST
+from django.utils.functional import SimpleLazyObject
+from .models import Product, UserProfile, Wishlist
+from . import caching, coupons, featured, idempotency, reference, review, sync
+from .analytics import record_view
+from .caching import lazy_cached
+from .cart import price_cart, resolve_cart
+from .cartstore import CartFull, get_cart, merge_anonymous_cart
+from .filters import filter_category, filter_doctors, search_catalog
+from .orders import CouponUnavailable, OrderError, ShippingDetails, place_order
+from .pagination import PRODUCT_SORTS, paginate, parse_page_size
+from .search import search_products
+from .taskqueue import HIGH, NORMAL, enqueue
+from .tasks import process_prescription
+from .uploads import (
+    MAX_SIZE as MAX_UPLOAD_SIZE, OffsetMismatch, PrescriptionUploadHandler, UploadRejected, append_chunk,
+    delete_if_unused, start_upload, stored_image, upload_offset,
+)
 
 # Home page view
 def home(request):
     from .models import Banner
-    featured_products = Product.objects.filter(stock__gt=0)[:4]  # Get 4 products with stock
-    categories = Category.objects.all()
-    banners = Banner.objects.filter(is_active=True).order_by('order', 'created_at')
+    # Served from the cache; the featured fragment itself is cached in home.html
+    featured_products = lazy_cached(caching.HOME, 'featured_products', lambda: featured.featured_products(4))
+    categories = SimpleLazyObject(reference.categories)
+    banners = lazy_cached(caching.HOME, 'banners', lambda: list(
+        Banner.objects.filter(is_active=True).order_by('order', 'created_at')
+    ))
     return render(request, 'pharmacy/home.html', {
         'featured_products': featured_products,
         'categories': categories,
-        'banners': banners
+        'banners': banners,
+        'home_generation': caching.generation(caching.HOME),
+        'fragment_timeout': caching.CACHE_TIMEOUT,
     })
 
 # View to display a list of all products with search and filtering
 def product_list(request):
-    products = Product.objects.all()
-    categories = Category.objects.all()
+    products = Product.objects.filter(is_active=True)
+    categories = reference.categories()
     
-    # Search functionality
+    # Search functionality (relevance-ranked, served from the full-text index)
     search_query = request.GET.get('search')
     if search_query:
-        products = products.filter(
-            name__icontains=search_query
-        ) | products.filter(
-            description__icontains=search_query
-        ) | products.filter(
-            category__name__icontains=search_query
-        )
+        products = search_products(search_query, products)
     
     # Category filtering
-    category_param = request.GET.get('category')
-    if category_param:
-        try:
-            # Try to filter by category ID
-            category_id = int(category_param)
-            products = products.filter(category_id=category_id)
-        except ValueError:
-            # Filter by category name if not a number
-            products = products.filter(category__name__icontains=category_param)
+    products = filter_category(products, request.GET.get('category'))
     
-    # Order by name
-    products = products.order_by('name')
+    # Order by name unless the search ranking already orders the results
+    field, descending = PRODUCT_SORTS['relevance' if search_query else 'name']
+    page = paginate(products.select_related('category'), field, descending, cursor=request.GET.get('cursor'))
     
     return render(request, 'pharmacy/product_list.html', {
-        'products': products,
-        'categories': categories
+        'products': page.items,
+        'page': page,
+        'categories': categories,
+        'total_product_count': reference.total_product_count(),
     })
 
 # View to display details of a specific product
@@ -74,6 +88,8 @@ def product_detail(request, pk):
             messages.success(request, 'Your review has been added!')
             return redirect('pharmacy:product_detail', pk=pk)
     
+    record_view(product.pk)
+    
     return render(request, 'pharmacy/product_detail.html', {
         'product': product,
         'comments': comments,
@@ -100,10 +116,23 @@ def contact(request):
     return render(request, 'pharmacy/contact.html')
 
 # Prescriptions page view
+@csrf_exempt
 def prescriptions(request):
-    from .models import Doctor, Specialization
+    # The streaming handler must be installed before anything reads
+    # request.POST, so CSRF is checked by the inner view instead.
+    upload_handler = PrescriptionUploadHandler(request)
+    request.upload_handlers.insert(0, upload_handler)
+    try:
+        return _prescriptions(request, upload_handler)
+    finally:
+        # Streamed before the CSRF and form checks: drop it unless a prescription was saved
+        delete_if_unused(upload_handler.stored_name)
+
+@csrf_protect
+def _prescriptions(request, upload_handler):
+    from .models import Doctor
     doctors = Doctor.objects.filter(is_active=True).select_related('specialization')
-    specializations = Specialization.objects.all()
+    specializations = reference.specializations()
     
     if request.method == 'POST':
         try:
@@ -114,7 +143,11 @@ def prescriptions(request):
             patient_phone = request.POST.get('patient_phone')
             patient_email = request.POST.get('patient_email')
             doctor_name = request.POST.get('doctor_name')
-            prescription_image = request.FILES.get('prescription_image')
+            if upload_handler.error:
+                raise UploadRejected(upload_handler.error)
+            prescription_image = stored_image(
+                request.FILES.get('prescription_image'), request.POST.get('prescription_upload'), request.user,
+            )
             delivery_address = request.POST.get('delivery_address')
             special_instructions = request.POST.get('special_instructions', '')
             is_urgent = request.POST.get('urgent') == 'on'
@@ -124,7 +157,8 @@ def prescriptions(request):
             if doctor_name:
                 doctor = Doctor.objects.filter(name__icontains=doctor_name, is_active=True).first()
             
-            # Create prescription
+            # Create prescription; validation, EXIF stripping and staff
+            # notifications happen in the background worker
             prescription = Prescription.objects.create(
                 user=request.user if request.user.is_authenticated else None,
                 doctor=doctor,
@@ -137,6 +171,8 @@ def prescriptions(request):
                 special_instructions=special_instructions,
                 is_urgent=is_urgent
             )
+            enqueue(process_prescription, {'prescription_id': prescription.pk},
+                    priority=HIGH if is_urgent else NORMAL)
             
             messages.success(request, f'Thank you {patient_name}! Your prescription has been uploaded successfully. We will process it within 2-4 hours.')
             return redirect('pharmacy:prescriptions')
@@ -146,31 +182,70 @@ def prescriptions(request):
     
     return render(request, 'pharmacy/prescriptions.html', {
         'doctors': doctors,
-        'specializations': specializations
+        'specializations': specializations,
+        'max_upload_mb': MAX_UPLOAD_SIZE // (1024 * 1024),
     })
 
+# Resumable prescription uploads (protocol described in uploads.py)
+@login_required
+@require_POST
+def prescription_upload_start(request):
+    try:
+        data = json.loads(request.body or b'{}')
+        token = start_upload(request.user, data.get('size'), data.get('content_type'))
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid request.'}, status=400)
+    except UploadRejected as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'upload': token, 'offset': 0}, status=201)
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def prescription_upload_chunk(request, token):
+    try:
+        if request.method == 'GET':
+            return JsonResponse({'offset': upload_offset(token, request.user)})
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length') or 0)
+        offset, file_token = append_chunk(token, request.user, offset, request, length)
+    except ValueError:
+        return JsonResponse({'error': 'Upload-Offset header is required.'}, status=400)
+    except OffsetMismatch as e:
+        return JsonResponse({'error': str(e), 'offset': e.offset}, status=409)
+    except UploadRejected as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if file_token:
+        return JsonResponse({'offset': offset, 'complete': True, 'file': file_token})
+    return JsonResponse({'offset': offset})
+
+# Bulk price/stock updates from the ERP (see sync.py); API key instead of a session, so no CSRF
+@csrf_exempt
+@require_POST
+def erp_product_sync(request):
+    if not sync.authorized(request):
+        return JsonResponse({'error': 'Invalid API key.'}, status=401)
+    try:
+        rows = json.loads(request.body)['products']
+        if not isinstance(rows, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"products": [...]}.'}, status=400)
+    if len(rows) > sync.MAX_ROWS:
+        return JsonResponse({'error': f'At most {sync.MAX_ROWS} rows per request.'}, status=400)
+    results = sync.apply_updates(rows)
+    return JsonResponse({'summary': sync.summarize(results), 'results': results})
+
 # View to add a product to the cart
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     
     if product.stock > 0:
-        # Initialize cart in session if it doesn't exist
-        if 'cart' not in request.session:
-            request.session['cart'] = {}
-        
-        cart = request.session['cart']
-        product_id_str = str(product_id)
-        
-        # Add or update product in cart
-        if product_id_str in cart:
-            cart[product_id_str] += 1
+        try:
+            get_cart(request).add(product.pk)
+        except CartFull as e:
+            messages.error(request, str(e))
         else:
-            cart[product_id_str] = 1
-        
-        request.session['cart'] = cart
-        request.session.modified = True
-        
-        messages.success(request, f'{product.name} has been added to your cart!')
+            messages.success(request, f'{product.name} has been added to your cart!')
     else:
         messages.error(request, f'Sorry, {product.name} is out of stock.')
     
@@ -179,26 +254,11 @@ def add_to_cart(request, product_id):
 
 # View to display the shopping cart
 def cart_view(request):
-    cart = request.session.get('cart', {})
-    cart_items = []
-    total_price = 0
-    
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(id=int(product_id))
-            item_total = product.price * quantity
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'item_total': item_total
-            })
-            total_price += item_total
-        except Product.DoesNotExist:
-            continue
+    cart = resolve_cart(get_cart(request).lines)
     
     return render(request, 'pharmacy/cart.html', {
-        'cart_items': cart_items,
-        'total_price': total_price
+        'cart_items': cart.items,
+        'total_price': cart.subtotal
     })
 
 # Combined Authentication view
@@ -221,6 +281,7 @@ def login_view(request):
         
         if user is not None:
             login(request, user)
+            merge_anonymous_cart(request, user)
             messages.success(request, f'Welcome back, {user.first_name}!')
             return redirect('pharmacy:home')
         else:
@@ -299,28 +360,22 @@ def logout_view(request):
 
 # View to remove item from cart
 def remove_from_cart(request, product_id):
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
+    cart = get_cart(request)
     
-    if product_id_str in cart:
+    if product_id in cart.lines:
         product = get_object_or_404(Product, id=product_id)
-        del cart[product_id_str]
-        request.session['cart'] = cart
-        request.session.modified = True
+        cart.remove(product_id)
         messages.success(request, f'{product.name} removed from cart!')
     
     return redirect('pharmacy:cart')
 
 # View to decrease item quantity in cart
 def decrease_cart(request, product_id):
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-    
-    if product_id_str in cart:
-        if cart[product_id_str] > 1:
-            cart[product_id_str] -= 1
-            request.session['cart'] = cart
-            request.session.modified = True
+    cart = get_cart(request)
+    
+    if product_id in cart.lines:
+        if cart.lines[product_id] > 1:
+            cart.decrease(product_id)
             messages.success(request, 'Quantity updated!')
         else:
             # If quantity is 1, remove the item
@@ -330,31 +385,173 @@ def decrease_cart(request, product_id):
 
 # View to clear entire cart
 def clear_cart(request):
-    request.session['cart'] = {}
-    request.session.modified = True
+    get_cart(request).clear()
     messages.success(request, 'Cart cleared!')
     return redirect('pharmacy:cart')
 
+CART_ITEM_ACTIONS = ('add', 'decrease', 'remove', 'set')
+
+def _cart_state(cart_store, product_id=None):
+    """The cart as JSON: the product's line (null once it is gone), totals and counts"""
+    cart = resolve_cart(cart_store.lines)
+    totals = price_cart(cart)
+    line = next((item for item in cart if item.product.pk == product_id), None)
+    return {
+        'line': line and {
+            'product_id': line.product.pk,
+            'name': line.product.name,
+            'price': str(line.product.price),
+            'quantity': line.quantity,
+            'item_total': str(line.item_total),
+        },
+        'totals': {
+            'subtotal': str(totals.subtotal),
+            'tax_amount': str(totals.tax_amount),
+            'shipping_cost': str(totals.shipping_cost),
+            'total_amount': str(totals.total_amount),
+        },
+        'cart_count': cart.count,
+        'cart_items_count': len(cart),
+    }
+
+def _update_cart(cart_store, product_id, data):
+    """Apply one cart change, return (status, JSON payload)"""
+    action = data.get('action') or ('add' if product_id is not None else 'clear')
+    try:
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        quantity = -1
+    if quantity < 0 or (quantity == 0 and action != 'set'):
+        return 400, {'error': 'quantity must be a positive whole number.'}
+
+    if product_id is None:
+        if action != 'clear':
+            return 400, {'error': 'Only "clear" applies to the whole cart.'}
+        cart_store.clear()
+        return 200, {'message': 'Cart cleared!', **_cart_state(cart_store)}
+    if action not in CART_ITEM_ACTIONS:
+        return 400, {'error': f'action must be one of: {", ".join(CART_ITEM_ACTIONS)}.'}
+
+    product = Product.objects.filter(pk=product_id).only('name', 'stock').first()
+    if product is None:
+        return 404, {'error': 'Product not found.'}
+    if action in ('add', 'set') and quantity and product.stock <= 0:
+        return 400, {'error': f'Sorry, {product.name} is out of stock.'}
+    try:
+        if action == 'add':
+            cart_store.add(product.pk, quantity)
+            message = f'{product.name} has been added to your cart!'
+        elif action == 'set':
+            cart_store.set(product.pk, quantity)
+            message = 'Quantity updated!' if quantity else f'{product.name} removed from cart!'
+        elif action == 'decrease':
+            cart_store.decrease(product.pk, quantity)
+            message = 'Quantity updated!'
+        else:
+            cart_store.remove(product.pk)
+            message = f'{product.name} removed from cart!'
+    except CartFull as e:
+        return 400, {'error': str(e)}
+    return 200, {'message': message, **_cart_state(cart_store, product.pk)}
+
+# JSON cart for scripts: a change and the updated cart in one round trip,
+# without the redirect and page render of the views above. Changes may carry
+# an Idempotency-Key header so they can be retried safely.
+@require_http_methods(['GET', 'POST'])
+def cart_json(request, product_id=None):
+    cart_store = get_cart(request)
+    if request.method == 'GET':
+        return JsonResponse(_cart_state(cart_store, product_id))
+
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Expected a JSON object.'}, status=400)
+    else:
+        data = request.POST
+    fingerprint = (product_id, data.get('action'), str(data.get('quantity', 1)))
+    try:
+        key = idempotency.request_key(request)
+        result = key and idempotency.start(request, key, fingerprint)
+    except idempotency.IdempotencyError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+    if result:
+        status, payload, lines = result
+        if lines is not None:
+            # The first response may never have arrived, and with it the cookie
+            cart_store.restore(dict(lines))
+        response = JsonResponse(payload, status=status)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    try:
+        status, payload = _update_cart(cart_store, product_id, data)
+    except Exception:
+        if key:
+            idempotency.release(request, key)
+        raise
+    if key:
+        lines = list(cart_store.lines.items()) if cart_store.user is None else None
+        idempotency.finish(request, key, fingerprint, (status, payload, lines))
+    return JsonResponse(payload, status=status)
+
 # Doctors page view
 def doctors(request):
-    from .models import Doctor, Specialization
-    
-    doctors = Doctor.objects.filter(is_active=True).select_related('specialization')
-    specializations = Specialization.objects.all()
-    
-    # Filter by specialization
-    specialization_id = request.GET.get('specialization')
-    if specialization_id:
-        doctors = doctors.filter(specialization_id=specialization_id)
+    specializations = reference.specializations()
     
     # Order by name
-    doctors = doctors.order_by('name')
+    page = paginate(filter_doctors(request.GET), 'name', cursor=request.GET.get('cursor'))
     
     return render(request, 'pharmacy/doctors.html', {
-        'doctors': doctors,
+        'doctors': page.items,
+        'page': page,
         'specializations': specializations
     })
 
+# JSON page of doctors, for infinite scrolling
+def doctor_page_json(request):
+    page = paginate(
+        filter_doctors(request.GET), 'name',
+        cursor=request.GET.get('cursor'),
+        page_size=parse_page_size(request.GET.get('page_size')),
+    )
+    return JsonResponse({
+        'results': [{
+            'id': doctor.id,
+            'name': doctor.name,
+            'specialization': doctor.specialization.name,
+            'hospital': doctor.hospital,
+            'experience_years': doctor.experience_years,
+            'photo': doctor.photo.url if doctor.photo else None,
+        } for doctor in page],
+        'next_cursor': page.next_cursor or None,
+    })
+
+# Pharmacist review queue: work a claimed batch, urgent and oldest first
+@staff_member_required
+def review_queue(request):
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action == 'release':
+            released = review.release(request.user)
+            messages.info(request, f'{released} prescriptions returned to the queue.')
+            return redirect('pharmacy:home')
+        if action in review.DECISIONS:
+            ids = [int(pk) for pk in request.POST.getlist('prescriptions') if pk.isdigit()]
+            decided = review.decide(request.user, ids, action, request.POST.get('notes', '').strip())
+            messages.success(request, f'{decided} prescriptions {action}.')
+        return redirect('pharmacy:review_queue')
+
+    return render(request, 'pharmacy/review_queue.html', {
+        'prescriptions': review.claim_batch(request.user),
+        'counts': review.queue_counts(),
+        'claim_minutes': review.CLAIM_TTL // 60,
+    })
+
 # User profile view
 @login_required
 def profile(request):
@@ -443,73 +640,82 @@ def wishlist_view(request):
 
 # Enhanced search view
 def advanced_search(request):
-    query = request.GET.get('q', '')
-    category_id = request.GET.get('category')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    sort_by = request.GET.get('sort', 'name')
-    
-    products = Product.objects.filter(is_active=True)
-    
-    if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(brand__icontains=query) |
-            Q(manufacturer__icontains=query)
-        )
-    
-    if category_id:
-        products = products.filter(category_id=category_id)
-    
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    
-    if max_price:
-        products = products.filter(price__lte=max_price)
-    
-    # Sorting
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'rating':
-        products = products.annotate(avg_rating=Avg('reviews__rating')).order_by('-avg_rating')
-    elif sort_by == 'newest':
-        products = products.order_by('-created_at')
-    else:
-        products = products.order_by('name')
+    products, sort_by = search_catalog(request.GET)
+    field, descending = PRODUCT_SORTS[sort_by]
+    page = paginate(products, field, descending, cursor=request.GET.get('cursor'))
     
-    categories = Category.objects.all()
+    categories = reference.categories()
     
     return render(request, 'pharmacy/advanced_search.html', {
-        'products': products,
+        'products': page.items,
+        'page': page,
         'categories': categories,
-        'query': query,
-        'selected_category': category_id,
-        'min_price': min_price,
-        'max_price': max_price,
+        'query': request.GET.get('q', ''),
+        'selected_category': request.GET.get('category'),
+        'min_price': request.GET.get('min_price'),
+        'max_price': request.GET.get('max_price'),
         'sort_by': sort_by,
     })
 
+# JSON page of advanced search results, for infinite scrolling
+def product_page_json(request):
+    products, sort_by = search_catalog(request.GET)
+    field, descending = PRODUCT_SORTS[sort_by]
+    page = paginate(
+        products, field, descending,
+        cursor=request.GET.get('cursor'),
+        page_size=parse_page_size(request.GET.get('page_size')),
+    )
+    return JsonResponse({
+        'results': [{
+            'id': product.id,
+            'name': product.name,
+            'slug': product.slug,
+            'brand': product.brand,
+            'category': product.category.name,
+            'price': str(product.price),
+            'mrp': str(product.mrp),
+            'stock': product.stock,
+            'is_prescription': product.is_prescription,
+            'image': product.image.url if product.image else None,
+            'url': reverse('pharmacy:product_detail', args=[product.id]),
+        } for product in page],
+        'sort': sort_by,
+        'next_cursor': page.next_cursor or None,
+    })
+
+def _applied_coupon(request, cart):
+    """The session's coupon if it still applies to cart; otherwise drop it and tell the customer why"""
+    applied = request.session.get('applied_coupon')
+    if applied is None:
+        return None
+    # Sessions from before coupons were kept by code hold the id
+    coupon = coupons.load(applied) if isinstance(applied, int) else coupons.lookup(applied)
+    error = 'This coupon is not valid or has expired.' if coupon is None else coupons.evaluate(coupon, cart).error
+    if error:
+        del request.session['applied_coupon']
+        messages.warning(request, f'Your coupon was removed. {error}')
+        return None
+    return coupon
+
 # Apply coupon view
 @login_required
 def apply_coupon(request):
     if request.method == 'POST':
         coupon_code = request.POST.get('coupon_code', '').strip().upper()
-        
-        try:
-            coupon = Coupon.objects.get(code=coupon_code)
-            
-            if not coupon.is_valid():
-                messages.error(request, 'This coupon is not valid or has expired.')
+        coupon = coupons.lookup(coupon_code)
+        if coupon is None:
+            messages.error(request, 'Invalid coupon code.')
+        else:
+            error = coupons.evaluate(coupon, resolve_cart(get_cart(request).lines)).error
+            if not error and coupons.user_limit_reached(coupon, request.user):
+                error = 'You have already used this coupon.'
+            if error:
+                messages.error(request, error)
             else:
-                # Store coupon in session
-                request.session['applied_coupon'] = coupon.id
+                # Store the code in the session; checkout looks it up again through the cache
+                request.session['applied_coupon'] = coupon.code
                 messages.success(request, f'Coupon {coupon_code} applied successfully!')
-                
-        except Coupon.DoesNotExist:
-            messages.error(request, 'Invalid coupon code.')
     
     return redirect('pharmacy:cart')
 
@@ -526,69 +732,58 @@ def newsletter_signup(request):
 # View to handle checkout
 @login_required
 def checkout(request):
-    cart = request.session.get('cart', {})
+    cart_store = get_cart(request)
+    cart = resolve_cart(cart_store.lines)
     if not cart:
         messages.error(request, 'Your cart is empty!')
         return redirect('pharmacy:cart')
     
-    cart_items = []
-    subtotal = 0
-    
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(id=int(product_id))
-            item_total = product.price * quantity
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'item_total': item_total
-            })
-            subtotal += item_total
-        except Product.DoesNotExist:
-            continue
-    
-    # Calculate totals
-    tax_rate = 0.18  # 18% GST
-    tax_amount = subtotal * tax_rate
-    shipping_cost = 50 if subtotal < 500 else 0  # Free shipping above 500
-    
     # Apply coupon if exists
-    discount_amount = 0
-    applied_coupon = None
-    coupon_id = request.session.get('applied_coupon')
-    
-    if coupon_id:
-        try:
-            coupon = Coupon.objects.get(id=coupon_id)
-            if coupon.is_valid() and subtotal >= coupon.minimum_amount:
-                if coupon.discount_type == 'percentage':
-                    discount_amount = (subtotal * coupon.discount_value) / 100
-                else:
-                    discount_amount = coupon.discount_value
-                applied_coupon = coupon
-        except Coupon.DoesNotExist:
-            pass
+    had_coupon = 'applied_coupon' in request.session
+    coupon = _applied_coupon(request, cart)
     
-    total_amount = subtotal + tax_amount + shipping_cost - discount_amount
+    # Calculate totals
+    totals = price_cart(cart, coupon)
     
-    payment_methods = PaymentMethod.objects.filter(is_active=True)
+    payment_methods = reference.payment_methods()
     
     if request.method == 'POST':
+        if had_coupon and coupon is None:
+            # The discount the customer saw is gone: show the new total before taking the order
+            return redirect('pharmacy:checkout')
         # Process order
-        messages.success(request, 'Order placed successfully! You will receive a confirmation email shortly.')
+        address = request.POST.get('address', '').strip()
+        city_zip = ' '.join(filter(None, [request.POST.get('city', '').strip(), request.POST.get('zip_code', '').strip()]))
+        shipping = ShippingDetails(
+            address='\n'.join(filter(None, [address, city_zip])),
+            phone=request.POST.get('phone', ''),
+            email=request.POST.get('email', '') or request.user.email,
+            notes=request.POST.get('notes', ''),
+        )
+        payment_method = reference.payment_method(request.POST.get('payment_method'))
+        try:
+            order = place_order(request.user, cart_store.lines, shipping,
+                                coupon_id=coupon.pk if coupon else None, payment_method=payment_method)
+        except OrderError as e:
+            if isinstance(e, CouponUnavailable):
+                request.session.pop('applied_coupon', None)
+            messages.error(request, str(e))
+            return redirect('pharmacy:cart')
+        
+        messages.success(request, f'Order {order.order_number} placed successfully! You will receive a confirmation email shortly.')
         # Clear cart and coupon
-        request.session['cart'] = {}
+        cart_store.clear()
         if 'applied_coupon' in request.session:
             del request.session['applied_coupon']
         return redirect('pharmacy:profile')
     
     return render(request, 'pharmacy/checkout.html', {
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'tax_amount': tax_amount,
-        'shipping_cost': shipping_cost,
-        'discount_amount': discount_amount,
-        'total_amount': total_amount,
-        'applied_coupon': applied_coupon,
+        'cart_items': cart.items,
+        'subtotal': totals.subtotal,
+        'tax_amount': totals.tax_amount,
+        'shipping_cost': totals.shipping_cost,
+        'discount_amount': totals.discount_amount,
+        'total_amount': totals.total_amount,
+        'applied_coupon': totals.coupon,
         'payment_methods': payment_methods,
     })
\ No newline at end of file
@@ -4,6 +4,7 @@ Django settings for pharmacy_project project.
 Generated by 'django-admin startproject' using Django 5.2.3.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pharmacy.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,9 +78,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Concurrent checkouts queue for the write lock at BEGIN instead
+            # of failing with "database is locked" (see inventory.allocate)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than SQLite's shared-cache in-memory database, whose
+        # table locks fail at once instead of waiting: the checkout stress
+        # test runs real concurrent connections
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+
+# Cache
+# Local memory by default; point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION at
+# e.g. django.core.cache.backends.filebased.FileBasedCache to share the cache
+# between processes.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'pharmacy'),
     }
 }
+PHARMACY_CACHE_TIMEOUT = 600
 
+# Bearer keys the ERP uses for the bulk price/stock endpoint (comma separated)
+PHARMACY_ERP_API_KEYS = [key for key in os.environ.get('PHARMACY_ERP_API_KEYS', '').split(',') if key]
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators